@@ -0,0 +1,128 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+import SKJson2VTk
+import PCL_COMPARE
+import RunSkeletonsMain
+import SyntheticSkeleton
+
+# Throughput and peak memory of the python stages on synthetic skeleton data of several sizes.
+# Each stage is timed as the best of a few repeats, peak memory is the tracemalloc peak of one
+# extra run (numpy allocations included). With --baseline the results are compared with an earlier
+# report and the script exits with 1 when a stage got slower or bigger than the tolerance.
+#   python Benchmark.py --sizes 1000 100000 1000000 --output Benchmark_Report.csv
+#   python Benchmark.py --baseline Benchmark_Report.csv
+
+REPORT_ROWS = 1000
+# differences below this are timer noise
+MIN_REGRESSION_SECONDS = 0.005
+
+def MeasureStage(stage_fn, repeats):
+    best_time = float('inf')
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        stage_fn()
+        best_time = min(best_time, time.perf_counter() - start_time)
+
+    tracemalloc.start()
+    try:
+        stage_fn()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best_time, peak_bytes
+
+# stage name -> (function, number of items it processes) for one synthetic case
+def CaseStages(json_path, reference_path, work_dir):
+    skeleton = SKJson2VTk.LoadSkeletonData(json_path)
+    ref_points = PCL_COMPARE.ReadVtkPoints(reference_path)
+    vertex_cnt = len(skeleton.vertices)
+    sk_point_cnt = len(skeleton.points)
+    vessel_vtk_path = os.path.join(work_dir, "Benchmark_Vessel.vtk")
+    centerline_vtk_path = os.path.join(work_dir, "Benchmark_Centerline.vtk")
+
+    return {
+        "parse_json": (lambda: SKJson2VTk.LoadSkeletonData(json_path), vertex_cnt),
+        "parse_json_lists": (lambda: SKJson2VTk.ParseDataFromJsons(json_path), vertex_cnt),
+        "metrics": (lambda: RunSkeletonsMain.ComputeRunMetrics(skeleton), sk_point_cnt),
+        "vessel_vtk": (lambda: SKJson2VTk.write_vtk_unstructured_grid(skeleton.vertices, skeleton.faces, vessel_vtk_path, 3), vertex_cnt),
+        "centerline_vtk": (lambda: SKJson2VTk.write_vtk_unstructured_grid(skeleton.points, skeleton.edges, centerline_vtk_path, 2), sk_point_cnt),
+        "read_reference_vtk": (lambda: PCL_COMPARE.ReadVtkPoints(reference_path), sk_point_cnt),
+        "compare": (lambda: PCL_COMPARE.CompareCenterlines(skeleton.points, ref_points), sk_point_cnt),
+    }
+
+def WriteReportRows(report_path):
+    case_metrics = RunSkeletonsMain.TRIAL_METRICS.copy()
+    for row in range(REPORT_ROWS):
+        RunSkeletonsMain.write_trial_data(report_path, "Case_" + str(row), case_metrics)
+
+# list of (size, stage, seconds, items per second, peak MB)
+def RunBenchmarks(sizes, repeats, work_dir):
+    results = []
+    for size in sizes:
+        json_path, reference_path = SyntheticSkeleton.WriteSyntheticCase(work_dir, "Synthetic_" + str(size), size)
+        for stage, (stage_fn, item_cnt) in CaseStages(json_path, reference_path, work_dir).items():
+            seconds, peak_bytes = MeasureStage(stage_fn, repeats)
+            results.append((size, stage, seconds, item_cnt / seconds if seconds else 0, peak_bytes / 1024**2))
+            print(f"{size:>9} {stage:<20} {seconds:10.4f} s {results[-1][3]:14.0f} items/s {results[-1][4]:10.1f} MB")
+
+    report_path = os.path.join(work_dir, "Benchmark_Trial_Report.csv")
+    def write_report():
+        open(report_path, "w").close()
+        WriteReportRows(report_path)
+    seconds, peak_bytes = MeasureStage(write_report, repeats)
+    results.append((REPORT_ROWS, "trial_report", seconds, REPORT_ROWS / seconds if seconds else 0, peak_bytes / 1024**2))
+    print(f"{REPORT_ROWS:>9} {'trial_report':<20} {seconds:10.4f} s {results[-1][3]:14.0f} items/s {results[-1][4]:10.1f} MB")
+    return results
+
+def WriteResults(results, output_path):
+    with open(output_path, "w") as report_file:
+        report_file.write('Size, Stage, Seconds, Items_Per_Second, Peak_MB\n')
+        for result in results:
+            report_file.write(",".join(str(value) for value in result) + "\n")
+
+def ReadResults(report_path):
+    results = {}
+    with open(report_path) as report_file:
+        next(report_file, None)
+        for line in report_file:
+            values = [value.strip() for value in line.split(',')]
+            if len(values) == 5:
+                results[(int(values[0]), values[1])] = (float(values[2]), float(values[4]))
+    return results
+
+# stages that are slower or use more memory than the baseline by more than tolerance
+def FindRegressions(results, baseline, tolerance):
+    regressions = []
+    for size, stage, seconds, _, peak_mb in results:
+        if (size, stage) not in baseline:
+            continue
+        baseline_seconds, baseline_peak_mb = baseline[(size, stage)]
+        if seconds > baseline_seconds * (1 + tolerance) and seconds - baseline_seconds > MIN_REGRESSION_SECONDS:
+            regressions.append(f"{stage} at {size}: {seconds:.4f} s, baseline {baseline_seconds:.4f} s")
+        if peak_mb > baseline_peak_mb * (1 + tolerance) and peak_mb - baseline_peak_mb > 1:
+            regressions.append(f"{stage} at {size}: {peak_mb:.1f} MB, baseline {baseline_peak_mb:.1f} MB")
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the python stages on synthetic skeleton data")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="surface mesh vertices")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", default="Benchmark_Report.csv")
+    parser.add_argument("--baseline", help="earlier benchmark report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown / memory growth")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        results = RunBenchmarks(args.sizes, args.repeats, work_dir)
+
+    baseline = ReadResults(args.baseline) if args.baseline else None
+    WriteResults(results, args.output)
+    if baseline is not None:
+        regressions = FindRegressions(results, baseline, args.tolerance)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,108 @@
+import os
+import json
+import FileUtils
+import ResultCache
+import StlReader
+import ReferenceStore
+
+# Experiment level index of the cases, built once into <experiment>/Case_Manifest.json: every STL of
+# the input directory by case name with its path, size, content hash (the one ResultCache keys on),
+# triangle count, bounding box, surface area (see StlReader.py) and reference centerline. Trials
+# reuse it while the modification times of the STL directory and of the reference source are
+# unchanged and every STL still has the size and modification time it was indexed with, an STL
+# edited in place does not change the directory mtime. A rebuild only rereads the STLs whose size or
+# modification time changed.
+
+MANIFEST_FILE = "Case_Manifest.json"
+MANIFEST_VERSION = 2
+
+def CaseName(stl_path):
+    return os.path.basename(stl_path).split(".stl")[0]
+
+def SourceMtime(path):
+    if not path or not os.path.exists(path):
+        return None
+    return os.stat(path).st_mtime_ns
+
+def ReadManifest(manifest_path):
+    try:
+        with open(manifest_path) as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, ValueError):
+        return None
+
+def WriteManifest(manifest_path, manifest):
+    FileUtils.AtomicWrite(manifest_path, lambda manifest_file: json.dump(manifest, manifest_file, indent=1))
+
+def IsEntryCurrent(entry):
+    try:
+        stat = os.stat(entry["path"])
+    except OSError:
+        return False
+    return entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns
+
+def IsManifestCurrent(manifest, stl_dir, reference_source=None):
+    return (manifest is not None and manifest.get("version") == MANIFEST_VERSION
+            and manifest.get("stl_dir") == os.path.abspath(stl_dir)
+            and manifest.get("stl_dir_mtime") == SourceMtime(stl_dir)
+            and manifest.get("reference_source") == reference_source
+            and manifest.get("reference_mtime") == SourceMtime(reference_source)
+            and all(IsEntryCurrent(entry) for entry in manifest["cases"].values()))
+
+# manifest entry of one STL, the previous entry is reused while the file looks unchanged
+def CaseEntry(stl_path, previous=None):
+    if previous is not None and previous["path"] == stl_path and IsEntryCurrent(previous):
+        return dict(previous)
+    stat = os.stat(stl_path)
+    entry = {
+        "path": stl_path,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "hash": ResultCache.FileHash(stl_path),
+    }
+    entry.update(StlReader.StlStats(stl_path))
+    return entry
+
+def BuildManifest(stl_dir, reference_source=None, previous=None):
+    stl_dir = os.path.abspath(stl_dir)
+    previous_cases = {}
+    if previous is not None and previous.get("version") == MANIFEST_VERSION:
+        previous_cases = previous.get("cases", {})
+    references = ReferenceStore.OpenReferenceStore(reference_source) if reference_source else None
+
+    cases = {}
+    for file in sorted(os.listdir(stl_dir)):
+        if file.endswith('.stl'):
+            stl_path = os.path.join(stl_dir, file)
+            case_name = CaseName(stl_path)
+            cases[case_name] = CaseEntry(stl_path, previous_cases.get(case_name))
+            cases[case_name]["reference"] = None
+            if references is not None and references.Contains(case_name):
+                cases[case_name]["reference"] = references.GetEntryName(case_name)
+    return {
+        "version": MANIFEST_VERSION,
+        "stl_dir": stl_dir,
+        "stl_dir_mtime": SourceMtime(stl_dir),
+        "reference_source": reference_source,
+        "reference_mtime": SourceMtime(reference_source),
+        "cases": cases,
+    }
+
+# the experiment's manifest, rebuilt when the STL directory, one of its STLs or the references changed
+def LoadManifest(experiment_dir, stl_dir, reference_source=None):
+    manifest_path = os.path.join(experiment_dir, MANIFEST_FILE)
+    manifest = ReadManifest(manifest_path)
+    if IsManifestCurrent(manifest, stl_dir, reference_source):
+        return manifest
+
+    manifest = BuildManifest(stl_dir, reference_source, manifest)
+    WriteManifest(manifest_path, manifest)
+    return manifest
+
+# STL paths of the manifest in file name order
+def InputFiles(manifest):
+    return [entry["path"] for entry in manifest["cases"].values()]
+
+def CaseHash(manifest, case_name):
+    entry = manifest["cases"].get(case_name) if manifest else None
+    return entry["hash"] if entry else None
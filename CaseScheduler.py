@@ -0,0 +1,61 @@
+import math
+import numpy as np
+
+# Longest processing time first scheduling of the cases of a trial. Runtimes are predicted from the
+# past total_time of every case (Timeout_History.json, see CaseTimeouts.py) and the mesh size of its
+# STL (Case_Manifest.json, see CaseManifest.py): a case that ran before gets the median of its own
+# runtimes, the others a fit of log(time) on log(triangles) and log(surface area) over the cases
+# that ran. Starting the longest cases first keeps one big mesh from being started last and
+# stretching the makespan of the trial, results are still reported in case order.
+
+# cases with runtimes needed to fit the area term too, with fewer only the triangle count is used
+MIN_AREA_FIT_CASES = 6
+
+def CaseFeatures(entry):
+    return [1.0, math.log(max(1, entry["triangles"])), math.log(max(1e-9, entry.get("area", 0)))]
+
+# least squares fit of log(seconds) on the case features, None without any past runtimes
+def FitPredictor(manifest, runtimes):
+    features = []
+    log_times = []
+    for case_name, entry in manifest["cases"].items():
+        case_runtimes = [runtime for runtime in runtimes.get(case_name, []) if runtime > 0]
+        if case_runtimes:
+            features.append(CaseFeatures(entry))
+            log_times.append(math.log(np.median(case_runtimes)))
+    if not features:
+        return None
+
+    features = np.array(features)
+    log_times = np.array(log_times)
+    if len(features) >= MIN_AREA_FIT_CASES:
+        return np.linalg.lstsq(features, log_times, rcond=None)[0]
+    if len(features) >= 3:
+        return np.append(np.linalg.lstsq(features[:, :2], log_times, rcond=None)[0], 0.0)
+    # too few cases to fit a slope, runtime proportional to the triangle count
+    return np.array([np.mean(log_times - features[:, 1]), 1.0, 0.0])
+
+# case name -> predicted seconds, relative triangle counts when nothing ran yet
+def PredictRuntimes(manifest, runtimes):
+    coefficients = FitPredictor(manifest, runtimes)
+    predicted = {}
+    for case_name, entry in manifest["cases"].items():
+        case_runtimes = [runtime for runtime in runtimes.get(case_name, []) if runtime > 0]
+        if case_runtimes:
+            predicted[case_name] = float(np.median(case_runtimes))
+        elif coefficients is not None:
+            predicted[case_name] = math.exp(float(np.dot(coefficients, CaseFeatures(entry))))
+        else:
+            predicted[case_name] = float(entry["triangles"])
+    return predicted
+
+# case indices in the order to start them, longest predicted runtime first
+def LongestFirst(case_indices, case_names, predicted):
+    return sorted(case_indices, key=lambda case_index: -predicted.get(case_names[case_index], 0))
+
+# finish time of the last worker when the cases are started in order on worker_cnt workers
+def Makespan(runtimes, worker_cnt):
+    worker_times = [0.0] * max(1, worker_cnt)
+    for runtime in runtimes:
+        worker_times[worker_times.index(min(worker_times))] += runtime
+    return max(worker_times)
@@ -0,0 +1,79 @@
+import os
+import json
+import FileUtils
+import numpy as np
+import TrialPruning
+
+# Per case timeouts learned from the runtimes of earlier trials. The Total_Time of the passed cases in
+# the experiment's trial reports is collected into a small history file (case -> recent runtimes), each
+# trial report is read once. A case's timeout is a percentile of its runtimes times a factor, clamped
+# to a floor and a ceiling, cases with too few runs keep the fixed default timeout.
+
+HISTORY_FILE = "Timeout_History.json"
+MAX_SAMPLES = 50
+
+def ReadHistory(history_path):
+    if os.path.isfile(history_path):
+        try:
+            with open(history_path) as history_file:
+                return json.load(history_file)
+        except ValueError:
+            pass
+    return {"trials": [], "runtimes": {}}
+
+def WriteHistory(history_path, history):
+    FileUtils.AtomicWrite(history_path, lambda history_file: json.dump(history, history_file))
+
+# runtime of every passed case of a trial report
+def ReadCaseRuntimes(trial_report_path):
+    runtimes = {}
+    with open(trial_report_path) as report_file:
+        header = [column.strip() for column in next(report_file, '').split(',')]
+        if 'Total_Time' not in header:
+            return runtimes
+        time_index = header.index('Total_Time')
+        passed_index = header.index('passed')
+        for line in report_file:
+            values = line.rstrip('\n').split(',')
+            if len(values) == len(header) and int(values[passed_index]):
+                runtimes[values[0].strip()] = float(values[time_index])
+    return runtimes
+
+# history file of the trials at a proxy fidelity, 0 = full resolution
+def HistoryPath(experiment_dir, fidelity=0):
+    if not fidelity:
+        return os.path.join(experiment_dir, HISTORY_FILE)
+    return os.path.join(experiment_dir, HISTORY_FILE.replace(".json", "_" + str(fidelity) + ".json"))
+
+# add the trials of the main report that are not in the history yet, returns the history.
+# Concurrent trials may overwrite each other's update, the lost trials are simply read again next time.
+def UpdateHistory(experiment_dir, main_report_path, history_path=None, fidelity=0):
+    history_path = history_path or HistoryPath(experiment_dir, fidelity)
+    history = ReadHistory(history_path)
+    known_trials = set(history["trials"])
+    # the case runtimes of stopped and not promoted trials are as good as those of complete ones
+    reported_trials = TrialPruning.ReadCompletedTrials(main_report_path, fidelity, statuses=None)
+    new_trials = [trial_id for trial_id in reported_trials if trial_id not in known_trials]
+    if not new_trials:
+        return history
+
+    for trial_id in new_trials:
+        trial_report_path = os.path.join(experiment_dir, trial_id, "Trial_Report.csv")
+        if os.path.isfile(trial_report_path):
+            for case_name, runtime in ReadCaseRuntimes(trial_report_path).items():
+                runtimes = history["runtimes"].setdefault(case_name, [])
+                runtimes.append(runtime)
+                del runtimes[:-MAX_SAMPLES]
+        history["trials"].append(trial_id)
+    WriteHistory(history_path, history)
+    return history
+
+def CaseTimeout(runtimes, default, percentile, factor, floor, ceiling, min_samples):
+    if len(runtimes) < min_samples:
+        return default
+    return float(min(max(np.percentile(runtimes, percentile) * factor, floor), ceiling))
+
+# case name -> timeout for the cases of the history, other cases use the default
+def CaseTimeoutsFromHistory(history, default, percentile, factor, floor, ceiling, min_samples):
+    return {case_name: CaseTimeout(runtimes, default, percentile, factor, floor, ceiling, min_samples)
+            for case_name, runtimes in history["runtimes"].items()}
@@ -0,0 +1,133 @@
+import os
+import argparse
+import FileUtils
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Case level metrics of a whole experiment as one columnar dataset: every finished trial adds a
+# parquet fragment to <experiment>/Case_Metrics with a row per case, its metrics, the trial
+# parameters, status and fidelity (0 for full trials) and the wall time of every stage
+# (time_<stage>). Case names, trial ids and status are dictionary encoded. --compact merges the
+# fragments into Case_Metrics.parquet and an uncompressed Case_Metrics.arrow that can be memory
+# mapped. Needs pyarrow, without it the export is skipped.
+#   python ColumnarExport.py <experiment_dir>             add fragments for trials that have none
+#   python ColumnarExport.py <experiment_dir> --compact
+#   pyarrow.dataset.dataset("<experiment_dir>/Case_Metrics").to_table()
+
+DATASET_DIR = "Case_Metrics"
+FRAGMENT_SUFFIX = ".parquet"
+# trial report columns that are not named like their metric
+CSV_METRIC_NAMES = {"terminal_cnt": "termina"}
+INT_COLUMNS = {"case_index", "passed", "bifurcations", "termina", "iterations", "fidelity"}
+PARAMETER_COLUMNS = {"QST": "QualitySpeedTradeoff", "MST": "MedialSpeedTradeoff", "MinEL": "MinEdgeLength"}
+DICTIONARY_COLUMNS = ("trial_id", "case_name", "status")
+
+def FragmentPath(experiment_dir, trial_id):
+    return os.path.join(experiment_dir, DATASET_DIR, str(trial_id) + FRAGMENT_SUFFIX)
+
+# case name -> {time_<stage>: wall time} of a trial's Trial_Timings.csv
+def ReadStageTimes(timings_path):
+    stage_times = {}
+    for row in FileUtils.ReadCsvRows(timings_path):
+        stage_times.setdefault(row["Case"], {})["time_" + row["Stage"]] = float(row["Wall_Time"])
+    return stage_times
+
+# columns of one trial as a dictionary of name -> list, built from its csv reports
+def TrialColumns(experiment_dir, trial_id, main_report_row):
+    trial_dir = os.path.join(experiment_dir, str(trial_id))
+    case_rows = FileUtils.ReadCsvRows(os.path.join(trial_dir, "Trial_Report.csv"))
+    stage_times = ReadStageTimes(os.path.join(trial_dir, "Trial_Timings.csv"))
+    stages = sorted(set(stage for times in stage_times.values() for stage in times))
+
+    columns = {"trial_id": [], "case_index": [], "case_name": [], "status": [], "fidelity": []}
+    columns.update((name, []) for name in PARAMETER_COLUMNS.values())
+    for case_index, case_row in enumerate(case_rows):
+        columns["trial_id"].append(str(trial_id))
+        columns["case_index"].append(case_index)
+        columns["case_name"].append(case_row["Case"])
+        columns["status"].append(main_report_row.get("Status", "complete"))
+        columns["fidelity"].append(main_report_row.get("Fidelity") or 0)
+        for report_name, name in PARAMETER_COLUMNS.items():
+            columns[name].append(float(main_report_row[report_name]))
+        for csv_name, value in case_row.items():
+            if csv_name != "Case":
+                name = CSV_METRIC_NAMES.get(csv_name, csv_name.lower())
+                columns.setdefault(name, []).append(value)
+        case_times = stage_times.get(case_row["Case"], {})
+        for stage in stages:
+            columns.setdefault(stage, []).append(case_times.get(stage))
+    return columns
+
+def ColumnArray(name, values):
+    if name in DICTIONARY_COLUMNS:
+        return pa.array(values, type=pa.string()).dictionary_encode()
+    if name in INT_COLUMNS:
+        return pa.array([int(float(value)) for value in values], type=pa.int64())
+    return pa.array([None if value is None else float(value) for value in values], type=pa.float64())
+
+# write the fragment of a finished trial, returns its path or None when there is nothing to write
+def ExportTrial(experiment_dir, trial_id, main_report_row=None):
+    if pa is None:
+        return None
+    if main_report_row is None:
+        main_report_rows = [row for row in FileUtils.ReadCsvRows(os.path.join(experiment_dir, "Main_Report.csv")) if row["Trial_Id"] == str(trial_id)]
+        if not main_report_rows:
+            return None
+        main_report_row = main_report_rows[-1]
+
+    columns = TrialColumns(experiment_dir, trial_id, main_report_row)
+    if not columns["case_name"]:
+        return None
+    table = pa.table({name: ColumnArray(name, values) for name, values in columns.items()})
+    fragment_path = FragmentPath(experiment_dir, trial_id)
+    os.makedirs(os.path.dirname(fragment_path), exist_ok=True)
+    FileUtils.AtomicWritePath(fragment_path, lambda tmp_path: pq.write_table(table, tmp_path))
+    return fragment_path
+
+# add fragments for the trials of the main report that do not have one yet
+def ExportExperiment(experiment_dir, force=False):
+    exported_cnt = 0
+    for row in FileUtils.ReadCsvRows(os.path.join(experiment_dir, "Main_Report.csv")):
+        if force or not os.path.isfile(FragmentPath(experiment_dir, row["Trial_Id"])):
+            exported_cnt += ExportTrial(experiment_dir, row["Trial_Id"], row) is not None
+    return exported_cnt
+
+# merge all fragments into one parquet file and one memory mappable arrow file
+def Compact(experiment_dir):
+    dataset_dir = os.path.join(experiment_dir, DATASET_DIR)
+    fragment_paths = sorted(os.path.join(dataset_dir, name) for name in os.listdir(dataset_dir) if name.endswith(FRAGMENT_SUFFIX))
+    tables = [pq.read_table(path) for path in fragment_paths]
+    # stages missing from some trials become null columns
+    table = pa.concat_tables(tables, promote_options="default").unify_dictionaries()
+    parquet_path = os.path.join(experiment_dir, DATASET_DIR + ".parquet")
+    arrow_path = os.path.join(experiment_dir, DATASET_DIR + ".arrow")
+    FileUtils.AtomicWritePath(parquet_path, lambda tmp_path: pq.write_table(table, tmp_path))
+    FileUtils.AtomicWritePath(arrow_path, lambda tmp_path: WriteArrowFile(table, tmp_path))
+    return parquet_path, arrow_path
+
+def WriteArrowFile(table, path):
+    with pa.OSFile(path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+# the compacted experiment, memory mapped
+def ReadCompacted(experiment_dir):
+    with pa.memory_map(os.path.join(experiment_dir, DATASET_DIR + ".arrow")) as source:
+        return pa.ipc.open_file(source).read_all()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export the case metrics of an experiment to parquet / arrow")
+    parser.add_argument("experiment_dir")
+    parser.add_argument("--compact", action="store_true", help="also merge the fragments into one parquet and arrow file")
+    parser.add_argument("--force", action="store_true", help="rewrite fragments that already exist")
+    args = parser.parse_args()
+
+    if pa is None:
+        raise SystemExit("pyarrow is not installed")
+    print(str(ExportExperiment(args.experiment_dir, args.force)) + " trials exported")
+    if args.compact:
+        print("Compacted to " + ", ".join(Compact(args.experiment_dir)))
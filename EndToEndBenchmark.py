@@ -0,0 +1,130 @@
+import os
+import json
+import time
+import random
+import argparse
+import importlib
+import tempfile
+import SyntheticSkeleton
+import StlProxies
+
+# End to end orchestration benchmark without nni or SK_Lite: writes synthetic STLs (and reference
+# centerlines for the PCL main), points the main at MockSkLite.py and runs full trials with random
+# parameters from the search space, then reports the orchestration throughput in cases per minute.
+#   python EndToEndBenchmark.py --cases 20 --trials 3 --case-workers 4
+#   python EndToEndBenchmark.py --main RunSkeletonsMain_PCL --failure-rate 0.1 --timeout-rate 0.05 --timeout 5
+#   python EndToEndBenchmark.py --fidelities 0 2000 5000    every parameter set on full meshes and proxies
+
+MOCK_SK_LITE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "MockSkLite.py")
+SEARCH_SPACE_JSON = os.path.join(os.path.dirname(os.path.abspath(__file__)), "search_space.json")
+EXPERIMENT_NAME = "END_TO_END_BENCHMARK"
+
+# STLs of case_cnt synthetic trees with sizes spread around vertex_count
+def WriteCases(stl_dir, reference_dir, case_cnt, vertex_count, seed):
+    rng = random.Random(seed)
+    for case_index in range(case_cnt):
+        case_vertex_count = int(vertex_count * rng.uniform(0.5, 1.5))
+        SyntheticSkeleton.WriteSyntheticStl(stl_dir, "Case_" + str(case_index).zfill(3), case_vertex_count, reference_dir)
+
+# uniform samples of the search space ranges
+def SampleParameters(search_space_path, rng):
+    with open(search_space_path) as search_space_file:
+        search_space = json.load(search_space_file)
+    return {name: rng.uniform(*space["_value"]) for name, space in search_space.items()}
+
+def ConfigureMain(main_module, work_dir, stl_dir, reference_dir, args):
+    main_module.SKELETONIZE_EXE = MOCK_SK_LITE
+    main_module.INPUT_STL_DIR = stl_dir
+    main_module.OUTPUT_DIR = work_dir
+    main_module.EXPERIMENT_NAME = EXPERIMENT_NAME
+    main_module.SEARCH_SPACE_JSON = SEARCH_SPACE_JSON
+    main_module.CASE_WORKERS = args.case_workers
+    main_module.RESULT_CACHE_ENABLED = args.cache
+    main_module.RESULT_CACHE_DIR = os.path.join(work_dir, "result_cache")
+    main_module.STL_PROXY_DIR = os.path.join(work_dir, "stl_proxies")
+    # the temporary work dir may be gone before a detached pass finishes
+    main_module.RETENTION_IN_BACKGROUND = False
+    main_module.RETENTION_TOP_K = args.keep_top_k
+    if args.timeout:
+        main_module.SKETLTON_TIMEOUT = args.timeout
+    if hasattr(main_module, "VMTK_VTKS_DIR"):
+        main_module.VMTK_VTKS_DIR = reference_dir
+        main_module.REFERENCE_CACHE_DIR = os.path.join(work_dir, "reference_cache")
+
+# (cases run, cases passed) of a trial report
+def CountCases(trial_report_path):
+    case_cnt = passed_cnt = 0
+    with open(trial_report_path) as report_file:
+        next(report_file, None)
+        for line in report_file:
+            values = line.split(',')
+            if len(values) > 1:
+                case_cnt += 1
+                passed_cnt += int(values[1])
+    return case_cnt, passed_cnt
+
+def RunBenchmark(args, work_dir):
+    stl_dir = os.path.join(work_dir, "stls")
+    reference_dir = os.path.join(work_dir, "references")
+    os.makedirs(stl_dir, exist_ok=True)
+    os.makedirs(reference_dir, exist_ok=True)
+    WriteCases(stl_dir, reference_dir, args.cases, args.vertices, args.seed)
+
+    os.environ["MOCK_SK_WORK"] = args.work
+    os.environ["MOCK_SK_SECONDS_PER_MTRI"] = str(args.seconds_per_mtri)
+    os.environ["MOCK_SK_FAILURE_RATE"] = str(args.failure_rate)
+    os.environ["MOCK_SK_TIMEOUT_RATE"] = str(args.timeout_rate)
+    main_module = importlib.import_module(args.main)
+    ConfigureMain(main_module, work_dir, stl_dir, reference_dir, args)
+
+    rng = random.Random(args.seed)
+    total_cases = total_passed = 0
+    total_time = 0
+    for trial_index in range(args.trials):
+        params = SampleParameters(SEARCH_SPACE_JSON, rng)
+        for fidelity in args.fidelities:
+            trial_id = "TRIAL_" + str(trial_index).zfill(3) + ("_F" + str(fidelity) if fidelity else "")
+            start_time = time.time()
+            main_module.main(dict(params, ProxyFidelity=fidelity), trial_id)
+            trial_time = time.time() - start_time
+
+            case_cnt, passed_cnt = CountCases(os.path.join(work_dir, EXPERIMENT_NAME, trial_id, "Trial_Report.csv"))
+            total_cases += case_cnt
+            total_passed += passed_cnt
+            total_time += trial_time
+            print(f"{trial_id}: {case_cnt} cases, {passed_cnt} passed in {trial_time:.2f} s, {case_cnt / trial_time * 60:.1f} cases/min")
+
+    if len(args.fidelities) > 1:
+        correlations = StlProxies.ProxyCorrelation(os.path.join(work_dir, EXPERIMENT_NAME), main_module.CASE_SCORE_KEY)
+        for fidelity, stats in correlations.items():
+            print(f"Proxy {fidelity} triangles vs full resolution: trials {stats['trials']}, cases {stats['cases']}")
+
+    cases_per_minute = total_cases / total_time * 60 if total_time else 0
+    print(f"{args.trials} trials, {total_cases} cases, {total_passed} passed in {total_time:.2f} s: {cases_per_minute:.1f} cases/min")
+    return cases_per_minute
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run full trials against MockSkLite.py and measure cases per minute")
+    parser.add_argument("--main", default="RunSkeletonsMain", choices=["RunSkeletonsMain", "RunSkeletonsMain_PCL"])
+    parser.add_argument("--cases", type=int, default=20)
+    parser.add_argument("--vertices", type=int, default=20000, help="average surface mesh vertices of a case")
+    parser.add_argument("--trials", type=int, default=3)
+    parser.add_argument("--case-workers", type=int, default=0, help="cases run in parallel, 0 = automatic")
+    parser.add_argument("--work", default="sleep", choices=["sleep", "cpu"], help="how the mock spends its time")
+    parser.add_argument("--seconds-per-mtri", type=float, default=20, help="mock work time per million triangles")
+    parser.add_argument("--failure-rate", type=float, default=0)
+    parser.add_argument("--timeout-rate", type=float, default=0)
+    parser.add_argument("--timeout", type=float, default=0, help="fixed skeletonization timeout, 0 = the main's")
+    parser.add_argument("--cache", action="store_true", help="keep the result cache enabled")
+    parser.add_argument("--fidelities", type=int, nargs="+", default=[0], help="proxy triangle counts to run every parameter set at, 0 = full meshes")
+    parser.add_argument("--keep-top-k", type=int, default=10, help="trials that keep their artifacts uncompressed")
+    parser.add_argument("--work-dir", help="keep the experiment here instead of a temporary directory")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.work_dir:
+        os.makedirs(args.work_dir, exist_ok=True)
+        RunBenchmark(args, args.work_dir)
+    else:
+        with tempfile.TemporaryDirectory() as work_dir:
+            RunBenchmark(args, work_dir)
@@ -0,0 +1,104 @@
+import os
+import sys
+import json
+import zipfile
+import argparse
+import concurrent.futures
+import SKJson2VTk
+import FileUtils
+import TrialRetention
+import RunSkeletonsMain
+
+# Export vessel and centerline vtks after a search, for the selected trials only. The skeletons of a
+# trial compressed by TrialRetention.py are read from its archive without extracting it, a trial whose
+# skeletons were pruned can not be exported anymore and fails the export.
+#   python ExportTrialVtks.py <experiment_dir> --top-k 5
+#   python ExportTrialVtks.py <experiment_dir> --trials <trial_id> <trial_id>
+
+SKELETON_DATA_SUFFIX = '_SkeletonData.json'
+
+# ids of the k best fully evaluated trials of a main report
+def TopTrials(main_report_path, top_k, optimize_mode):
+    rows = [row for row in FileUtils.ReadCsvRows(main_report_path) if row.get('Status', 'complete') == 'complete']
+    rows.sort(key=lambda row: float(row['default']), reverse=(optimize_mode == 'maximize'))
+    return [row['Trial_Id'] for row in rows[:top_k]]
+
+# passed case names of a trial, the case directories of the output dir without a trial report
+def PassedCases(trial_dir):
+    trial_report_path = os.path.join(trial_dir, "Trial_Report.csv")
+    if os.path.isfile(trial_report_path):
+        return [row["Case"] for row in FileUtils.ReadCsvRows(trial_report_path) if int(row["passed"])]
+    output_dir = os.path.join(trial_dir, "output")
+    return sorted(os.listdir(output_dir)) if os.path.isdir(output_dir) else []
+
+# (skeleton json, archive or None, case name, vtk dir) of every passed case of a trial and the passed
+# cases whose skeleton is neither on disk nor in the retention archive
+def TrialExportJobs(trial_dir, force=False):
+    jobs = []
+    missing_cases = []
+    vtk_dir = os.path.join(trial_dir, "vtks")
+    archive_path = os.path.join(trial_dir, TrialRetention.ARCHIVE_NAME)
+    archived_names = set()
+    if os.path.isfile(archive_path):
+        with zipfile.ZipFile(archive_path) as archive:
+            archived_names = set(archive.namelist())
+    for case_name in PassedCases(trial_dir):
+        json_name = os.path.join("output", case_name, case_name + SKELETON_DATA_SUFFIX)
+        vessel_vtk_path = os.path.join(vtk_dir, case_name + "_Vessel.vtk")
+        if not force and os.path.isfile(vessel_vtk_path):
+            continue
+        if os.path.isfile(os.path.join(trial_dir, json_name)):
+            jobs.append((os.path.join(trial_dir, json_name), None, case_name, vtk_dir))
+        elif json_name.replace(os.sep, "/") in archived_names:
+            jobs.append((json_name.replace(os.sep, "/"), archive_path, case_name, vtk_dir))
+        else:
+            missing_cases.append(case_name)
+    return jobs, missing_cases
+
+def ExportCase(job):
+    json_path, archive_path, case_name, vtk_dir = job
+    if not os.path.exists(vtk_dir):
+        os.makedirs(vtk_dir, exist_ok=True)
+    if archive_path is not None:
+        with zipfile.ZipFile(archive_path) as archive:
+            skeleton = SKJson2VTk.Skeleton.FromJsonData(json.loads(archive.read(json_path)))
+        SKJson2VTk.WriteVesselAndCenterlineVtk(skeleton, case_name, vtk_dir)
+    else:
+        SKJson2VTk.WriteVesselAndCenterlineVtk(json_path, case_name, vtk_dir)
+    return case_name
+
+# exports the cases of the trials, returns (exported case count, trial id -> cases without a skeleton)
+def ExportTrials(experiment_dir, trial_ids, workers=None, force=False):
+    jobs = []
+    missing = {}
+    for trial_id in trial_ids:
+        trial_jobs, missing_cases = TrialExportJobs(os.path.join(experiment_dir, trial_id), force)
+        jobs += trial_jobs
+        if missing_cases:
+            missing[trial_id] = missing_cases
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        for job, case_name in zip(jobs, executor.map(ExportCase, jobs)):
+            print("Exported " + case_name + " to " + job[3])
+    return len(jobs), missing
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export vtks for selected trials of an experiment")
+    parser.add_argument("experiment_dir")
+    parser.add_argument("--top-k", type=int, default=5, help="export the k best trials of Main_Report.csv")
+    parser.add_argument("--trials", nargs="*", help="export these trial ids instead of the top k")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--force", action="store_true", help="overwrite vtks that already exist")
+    args = parser.parse_args()
+
+    trial_ids = args.trials
+    if not trial_ids:
+        optimize_mode = RunSkeletonsMain.ReadConfigValue(RunSkeletonsMain.CONFIG_YML, 'optimize_mode', 'minimize')
+        trial_ids = TopTrials(os.path.join(args.experiment_dir, "Main_Report.csv"), args.top_k, optimize_mode)
+    exported_cnt, missing = ExportTrials(args.experiment_dir, trial_ids, args.workers, args.force)
+    print(str(exported_cnt) + " cases exported")
+    for trial_id, missing_cases in missing.items():
+        print("Error: the skeletons of " + str(len(missing_cases)) + " passed cases of " + trial_id
+              + " were pruned by the retention policy and can not be exported: " + " ".join(missing_cases), file=sys.stderr)
+    if missing:
+        sys.exit(1)
@@ -0,0 +1,89 @@
+import os
+import time
+import threading
+import contextlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+# File helpers shared by the modules that write into directories read by concurrent trials: files
+# are written to a temporary path private to the process and thread, then renamed over the target so
+# readers only ever see the previous or the complete new file, and the csv reports are read as rows.
+# Rows appended to the shared experiment reports are written under FileLock.
+
+# temporary path next to path, unique per process and thread
+def TempPath(path):
+    return path + '.' + str(os.getpid()) + '.' + str(threading.get_ident()) + '.tmp'
+
+# write_fn(file) writes the file opened with mode, the target is replaced once it is complete
+def AtomicWrite(path, write_fn, mode='w'):
+    AtomicWritePath(path, lambda tmp_path: WriteFile(tmp_path, write_fn, mode))
+
+def WriteFile(path, write_fn, mode):
+    with open(path, mode) as file:
+        write_fn(file)
+
+# like AtomicWrite for writers that open the file themselves, write_fn(tmp_path)
+def AtomicWritePath(path, write_fn):
+    tmp_path = TempPath(path)
+    try:
+        write_fn(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+# bytes of all files below path, files removed meanwhile are skipped
+def DirSize(path):
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return size
+
+# exclusive lock on path + '.lock' held while the block runs, taken by every process and thread
+# that writes the file
+@contextlib.contextmanager
+def FileLock(path):
+    with open(path + '.lock', 'a+') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.01)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+# rows of a report as dictionaries keyed by the stripped column names, a last line that is still
+# being written is skipped
+def ReadCsvRows(csv_path):
+    rows = []
+    if not os.path.isfile(csv_path):
+        return rows
+    with open(csv_path) as csv_file:
+        header = [column.strip() for column in next(csv_file, '').split(',')]
+        for line in csv_file:
+            if not line.endswith('\n'):
+                break
+            values = [value.strip() for value in line.rstrip('\n').split(',')]
+            if len(values) == len(header):
+                rows.append(dict(zip(header, values)))
+    return rows
@@ -0,0 +1,78 @@
+import os
+import sys
+import time
+import random
+import configparser
+import numpy as np
+import SyntheticSkeleton
+import StlReader
+
+# Stand in for SK_Lite.exe to run and benchmark the orchestration on machines without the
+# executable. It reads the same [Main] launch file, works for a time proportional to the mesh size
+# and parameters, prints iteration lines and writes a synthetic <OutputName>_SkeletonData.json
+# of the tree the STL was generated from (see SyntheticSkeleton.py). Configured through the
+# environment since SK_Lite only gets the launch file:
+#   MOCK_SK_WORK             sleep | cpu, how the work time is spent (sleep)
+#   MOCK_SK_SECONDS_PER_MTRI seconds of work per million triangles at the default parameters (20)
+#   MOCK_SK_MIN_SECONDS      work time of the smallest meshes (0.05)
+#   MOCK_SK_FAILURE_RATE     fraction of runs that exit with an error and no output (0)
+#   MOCK_SK_TIMEOUT_RATE     fraction of runs that hang until they are killed (0)
+#   python MockSkLite.py <launch_file>
+
+PROGRESS_LINES = 10
+HANG_SECONDS = 3600
+
+def EnvFloat(name, default):
+    return float(os.environ.get(name, default))
+
+def ReadLaunchFile(launch_path):
+    parser = configparser.ConfigParser()
+    parser.optionxform = str
+    parser.read(launch_path)
+    return dict(parser['Main'])
+
+def Work(seconds, mode):
+    deadline = time.time() + seconds
+    step = seconds / PROGRESS_LINES
+    for iteration in range(1, PROGRESS_LINES + 1):
+        if mode == "cpu":
+            step_deadline = min(deadline, time.time() + step)
+            while time.time() < step_deadline:
+                np.sqrt(np.arange(10000.0)).sum()
+        else:
+            time.sleep(max(0, min(step, deadline - time.time())))
+        print("Iteration " + str(iteration), flush=True)
+
+def main(launch_path):
+    params = ReadLaunchFile(launch_path)
+    case_name = os.path.basename(params['OutputName'])
+    min_edge_length = float(params.get('MinEdgeLength', 0.065))
+    quality_tradeoff = float(params.get('QualitySpeedTradeoff', 0.5))
+    max_iterations = float(params.get('MaxIterations', 600))
+    rng = random.Random(case_name + "|" + "|".join(key + "=" + params[key] for key in sorted(params)))
+
+    print("Reading " + params['Input'], flush=True)
+    triangle_cnt = StlReader.TriangleCount(params['Input'])
+
+    draw = rng.random()
+    if draw < EnvFloat("MOCK_SK_FAILURE_RATE", 0):
+        print("Error: skeletonization did not converge", flush=True)
+        return 1
+    if draw < EnvFloat("MOCK_SK_FAILURE_RATE", 0) + EnvFloat("MOCK_SK_TIMEOUT_RATE", 0):
+        print("Iteration 1", flush=True)
+        time.sleep(HANG_SECONDS)
+        return 1
+
+    # smaller edges and higher quality cost more, like the real thing
+    work_seconds = EnvFloat("MOCK_SK_SECONDS_PER_MTRI", 20) * triangle_cnt / 1e6 * (0.5 + quality_tradeoff) * max_iterations / 600
+    Work(max(EnvFloat("MOCK_SK_MIN_SECONDS", 0.05), work_seconds), os.environ.get("MOCK_SK_WORK", "sleep"))
+
+    # the tree of the STL, with polylines sampled more finely for smaller edges
+    segment_points = max(2, int(round(SyntheticSkeleton.SEGMENT_POINTS * 0.5 / max(min_edge_length, 0.05))))
+    skeleton_data = SyntheticSkeleton.GenerateSkeletonData(triangle_cnt // 2, segment_points, seed=SyntheticSkeleton.CaseSeed(case_name))
+    SyntheticSkeleton.WriteSkeletonJson(skeleton_data, params['OutputName'] + "_SkeletonData.json")
+    print("Skeletonization finished", flush=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1]))
@@ -1,10 +1,120 @@
+import os
 import subprocess
 import re
+import json
+import numpy as np
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
 
 # The path to the C++ executable
-PCL_EXE_PATH = "C:\\Users\\mcitrin\\Documents\\Submodule_Test\\build\\submodules\\Release\\PointCloudComparisonMain.exe"
+PCL_EXE_PATH = os.environ.get("PCL_EXE_PATH", "C:\\Users\\mcitrin\\Documents\\Submodule_Test\\build\\submodules\\Release\\PointCloudComparisonMain.exe")
+
+# "exe" runs PointCloudComparisonMain.exe and reproduces the scores of earlier experiments,
+# "chamfer", "hausdorff" and "coverage" compare the point clouds in process (any platform)
+PCL_COMPARE_MODE = "exe" if os.name == 'nt' and os.path.isfile(PCL_EXE_PATH) else "chamfer"
+# reference points closer than this to a skeleton point count as covered
+COVERAGE_TOLERANCE = 1.0
+# number of query points compared at once when scipy is not installed
+BRUTE_FORCE_CHUNK = 256
+FAILED_SCORE = 1e+10
+
+SKPOINTS_KEY = 'SkPoints'
+
+# returns the skeleton points as an Nx3 array, skeleton is the path of a skeleton data json
+# or its already decoded flat SkPoints
+def ReadSkeletonPoints(skeleton):
+    if isinstance(skeleton, str):
+        with open(skeleton) as json_file:
+            skeleton = json.load(json_file)[SKPOINTS_KEY]
+    raw_sk_points = np.asarray(skeleton, dtype=np.float64)
+    return raw_sk_points[:raw_sk_points.size // 3 * 3].reshape(-1, 3)
+
+# returns the POINTS section of a legacy ASCII vtk file (path or open text stream) as an Nx3 array
+def ReadVtkPoints(vtk_file):
+    if isinstance(vtk_file, str):
+        with open(vtk_file) as stream:
+            return ReadVtkPoints(stream)
+
+    for line in vtk_file:
+        if line.startswith('POINTS'):
+            num_values = int(line.split()[1]) * 3
+            break
+    else:
+        raise ValueError("No POINTS section found in vtk file")
+
+    tokens = []
+    for line in vtk_file:
+        if len(tokens) >= num_values:
+            break
+        tokens.extend(line.split())
+    return np.array(tokens[:num_values], dtype=np.float64).reshape(-1, 3)
+
+# spatial index over points, None when scipy is not installed
+def BuildPointTree(points):
+    if cKDTree is None:
+        return None
+    return cKDTree(points)
+
+# distance from each query point to its nearest neighbour in points
+def NearestDistances(query_points, points, tree=None):
+    if tree is None:
+        tree = BuildPointTree(points)
+    if tree is not None:
+        distances, _ = tree.query(query_points)
+        return distances
+
+    # |a - b|^2 = |a|^2 - 2 a.b + |b|^2 keeps the chunk buffer at chunk x len(points)
+    distances = np.empty(len(query_points))
+    points_norm = (points**2).sum(axis=1)
+    for start in range(0, len(query_points), BRUTE_FORCE_CHUNK):
+        chunk = query_points[start:start + BRUTE_FORCE_CHUNK]
+        squared = (chunk**2).sum(axis=1)[:, None] - 2 * chunk @ points.T + points_norm[None, :]
+        distances[start:start + len(chunk)] = np.sqrt(np.maximum(squared.min(axis=1), 0))
+    return distances
+
+# symmetric comparison of a skeleton against a reference centerline
+def CompareCenterlines(sk_points, ref_points, sk_tree=None, ref_tree=None):
+    if len(sk_points) == 0 or len(ref_points) == 0:
+        return {'chamfer': FAILED_SCORE, 'hausdorff': FAILED_SCORE, 'coverage': 0.0}
+
+    sk_to_ref = NearestDistances(sk_points, ref_points, ref_tree)
+    ref_to_sk = NearestDistances(ref_points, sk_points, sk_tree)
+    return {
+        'chamfer': float((sk_to_ref.mean() + ref_to_sk.mean()) / 2),
+        'hausdorff': float(max(sk_to_ref.max(), ref_to_sk.max())),
+        # percentage of the reference centerline that the skeleton reaches
+        'coverage': float((ref_to_sk <= COVERAGE_TOLERANCE).mean() * 100),
+    }
+
+# score of a comparison in the given mode, lower is better
+def CompareScore(scores, mode):
+    if mode == "coverage":
+        return 100 - scores['coverage']
+    return scores[mode]
+
+def PCL_COMPARE_2_VMTK(json_path, vtk_path, mode=None):
+    mode = mode or PCL_COMPARE_MODE
+    if mode == "exe":
+        return PCL_COMPARE_EXE(json_path, vtk_path)
+
+    scores = CompareCenterlines(ReadSkeletonPoints(json_path), ReadVtkPoints(vtk_path))
+    score = CompareScore(scores, mode)
+    print(f"Centerline comparison {scores}, {mode} score: {score}")
+    return score
+
+# compare a skeleton (json path or decoded SkPoints) against already loaded reference points
+# and optionally their KD-tree
+def PCL_COMPARE_2_REFERENCE(skeleton, ref_points, ref_tree=None, mode=None):
+    mode = mode or PCL_COMPARE_MODE
+    scores = CompareCenterlines(ReadSkeletonPoints(skeleton), ref_points, ref_tree=ref_tree)
+    score = CompareScore(scores, mode)
+    print(f"Centerline comparison {scores}, {mode} score: {score}")
+    return score
 
-def PCL_COMPARE_2_VMTK(json_path, vtk_path):
+def PCL_COMPARE_EXE(json_path, vtk_path):
     # Call the executable using subprocess
     process = subprocess.Popen([PCL_EXE_PATH, json_path, vtk_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
 
@@ -29,4 +139,4 @@ def PCL_COMPARE_2_VMTK(json_path, vtk_path):
                 print(f"Could not convert score to float: {score_str}")
         else:
             print("No line with 'SCORE:' found in the output.")
-    return 1e+10
\ No newline at end of file
+    return FAILED_SCORE
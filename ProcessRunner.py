@@ -0,0 +1,162 @@
+import os
+import re
+import sys
+import time
+import threading
+import subprocess
+import collections
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Runs a child process while streaming its output line by line. Only the last lines are kept in
+# memory, the full log goes to a partial file that replaces the log on failure. On success the
+# caller decides with KeepLog or DiscardLog, e.g. once it found the output the child should have written.
+# Progress lines are parsed as they arrive and the child's peak memory and cpu time are recorded.
+# The peak memory is sampled while the child runs, VmHWM from /proc on linux and psutil (when
+# installed) elsewhere, the rusage of wait4 is not used for it since on linux ru_maxrss carries the
+# parent's high-water mark over fork and exec. The cpu time comes from wait4 on posix and psutil
+# elsewhere. Memory that a child only allocates in its last poll interval can be missed.
+# The child is killed when it runs past its timeout or when the cancel event is set, e.g. because
+# its trial was stopped early.
+
+TAIL_LINES = 200
+POLL_INTERVAL = 0.05
+PROC_STATUS = os.path.isfile('/proc/self/status')
+PROGRESS_PATTERN = re.compile(r'iter(?:ation)?s?\s*[:=#]?\s*(\d+)', re.IGNORECASE)
+
+# python scripts (like MockSkLite.py) are run with the current interpreter on every platform
+def ScriptCommand(command):
+    if command[0].endswith('.py'):
+        return [sys.executable] + list(command)
+    return command
+
+def ReadOutput(stream, run_stats, tail, log_file, echo_prefix):
+    for line in stream:
+        tail.append(line)
+        run_stats["output_lines"] += 1
+        if log_file is not None:
+            log_file.write(line)
+        match = PROGRESS_PATTERN.search(line)
+        if match:
+            run_stats["iterations"] = int(match.group(1))
+        if echo_prefix is not None:
+            print(echo_prefix + line, end='')
+
+def RusageToStats(rusage, run_stats):
+    run_stats["cpu_time"] = rusage.ru_utime + rusage.ru_stime
+
+# peak resident memory of a running process on linux, None once it exited
+def ReadVmHwm(pid):
+    try:
+        with open('/proc/' + str(pid) + '/status') as status_file:
+            for line in status_file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+def SampleProcess(pid, process, run_stats):
+    peak_rss = None
+    if PROC_STATUS:
+        peak_rss = ReadVmHwm(pid)
+    elif process is not None:
+        try:
+            memory = process.memory_info()
+            if not hasattr(os, 'wait4'):
+                cpu_times = process.cpu_times()
+                run_stats["cpu_time"] = cpu_times.user + cpu_times.system
+        except psutil.Error:
+            return
+        peak_rss = getattr(memory, 'peak_wset', memory.rss)
+    if peak_rss is not None:
+        run_stats["peak_rss"] = max(run_stats["peak_rss"] or 0, peak_rss)
+
+def OpenSampledProcess(pid):
+    if psutil is None or PROC_STATUS:
+        return None
+    try:
+        return psutil.Process(pid)
+    except psutil.Error:
+        return None
+
+# returns (returncode, output tail, run stats), the process is killed when it times out or cancel_event is set
+def RunStreaming(command, timeout, log_path=None, echo_prefix=None, tail_lines=TAIL_LINES, cancel_event=None):
+    run_stats = {"output_lines": 0, "iterations": 0, "peak_rss": None, "cpu_time": None, "timed_out": False, "cancelled": False,
+                 "partial_log": None}
+    tail = collections.deque(maxlen=tail_lines)
+    partial_log_path = log_path + ".partial" if log_path else None
+    log_file = open(partial_log_path, "w") if partial_log_path else None
+    returncode = None
+
+    try:
+        with subprocess.Popen(ScriptCommand(command), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True, errors='replace') as p:
+            reader = threading.Thread(target=ReadOutput, args=(p.stdout, run_stats, tail, log_file, echo_prefix), daemon=True)
+            reader.start()
+            # Popen returns after the exec, samples are never of the forked copy of this process
+            sampled_process = OpenSampledProcess(p.pid)
+            deadline = time.time() + timeout
+
+            while returncode is None:
+                SampleProcess(p.pid, sampled_process, run_stats)
+                if hasattr(os, 'wait4'):
+                    pid, status, rusage = os.wait4(p.pid, os.WNOHANG)
+                    if pid:
+                        RusageToStats(rusage, run_stats)
+                        returncode = os.waitstatus_to_exitcode(status)
+                        # reaped here, let Popen know so it does not wait again
+                        p.returncode = returncode
+                        break
+                else:
+                    returncode = p.poll()
+                    if returncode is not None:
+                        break
+
+                if cancel_event is not None and cancel_event.is_set():
+                    run_stats["cancelled"] = True
+                elif time.time() > deadline:
+                    run_stats["timed_out"] = True
+                if run_stats["cancelled"] or run_stats["timed_out"]:
+                    p.kill()
+                    if hasattr(os, 'wait4'):
+                        _, status, rusage = os.wait4(p.pid, 0)
+                        RusageToStats(rusage, run_stats)
+                        p.returncode = os.waitstatus_to_exitcode(status)
+                    else:
+                        p.wait()
+                    break
+                time.sleep(POLL_INTERVAL)
+
+            # a grandchild holding the pipe open must not block us after the child is gone
+            reader.join(5)
+    finally:
+        if log_file is not None:
+            log_file.close()
+
+    if log_path:
+        if returncode == 0:
+            run_stats["partial_log"] = partial_log_path
+        else:
+            with open(partial_log_path, "a") as log_file:
+                if run_stats["timed_out"]:
+                    log_file.write(f"The process took too long (more than {timeout} seconds) and was terminated.\n")
+                elif run_stats["cancelled"]:
+                    log_file.write("The process was cancelled and terminated.\n")
+            os.replace(partial_log_path, log_path)
+
+    return returncode, "".join(tail), run_stats
+
+# the log of a successful run replaces log_path
+def KeepLog(run_stats, log_path):
+    partial_log_path = run_stats.pop("partial_log", None) if run_stats else None
+    if partial_log_path:
+        os.replace(partial_log_path, log_path)
+
+# the log of a successful run is removed
+def DiscardLog(run_stats):
+    partial_log_path = run_stats.pop("partial_log", None) if run_stats else None
+    if partial_log_path and os.path.isfile(partial_log_path):
+        os.remove(partial_log_path)
@@ -0,0 +1,69 @@
+import os
+import sys
+import pickle
+import FileUtils
+import numpy as np
+import PCL_COMPARE
+import ReferenceStore
+
+# Preprocessed VMTK reference centerlines: <case>.npy holds the float32 points and
+# <case>.kdtree.pkl the pickled KD-tree, both written once and shared by every trial.
+
+POINTS_SUFFIX = '.npy'
+TREE_SUFFIX = '.kdtree.pkl'
+
+# references already loaded by this process
+_loaded_references = {}
+
+def ReferenceCachePaths(cache_dir, case_name):
+    base_path = os.path.join(cache_dir, case_name.lower())
+    return base_path + POINTS_SUFFIX, base_path + TREE_SUFFIX
+
+def IsCacheCurrent(store, cache_dir, case_name):
+    points_path, _ = ReferenceCachePaths(cache_dir, case_name)
+    return os.path.isfile(points_path) and os.path.getmtime(points_path) >= store.GetMtime(case_name)
+
+# parse one reference of the store into the cache
+def CacheReference(store, cache_dir, case_name):
+    points_path, tree_path = ReferenceCachePaths(cache_dir, case_name)
+    points = store.ReadPoints(case_name).astype(np.float32)
+    tree = PCL_COMPARE.BuildPointTree(points)
+    if tree is not None:
+        FileUtils.AtomicWrite(tree_path, lambda file: pickle.dump(tree, file, protocol=pickle.HIGHEST_PROTOCOL), 'wb')
+    # points last, their mtime marks the cache entry as current
+    FileUtils.AtomicWrite(points_path, lambda file: np.save(file, points), 'wb')
+
+# parse every reference of source (a vtk directory or zip) that is missing or older in the cache
+def BuildReferenceCache(source, cache_dir):
+    store = ReferenceStore.OpenReferenceStore(source)
+    if not store.Cases():
+        return 0
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+
+    cached_cnt = 0
+    for case_name in store.Cases():
+        if not IsCacheCurrent(store, cache_dir, case_name):
+            CacheReference(store, cache_dir, case_name)
+            cached_cnt += 1
+    return cached_cnt
+
+# returns (points, tree) of a cached reference, points are memory mapped, None if not cached
+def LoadReference(cache_dir, case_name):
+    points_path, tree_path = ReferenceCachePaths(cache_dir, case_name)
+    if points_path in _loaded_references:
+        return _loaded_references[points_path]
+    if not os.path.isfile(points_path):
+        return None
+
+    points = np.load(points_path, mmap_mode='r')
+    tree = None
+    if os.path.isfile(tree_path):
+        with open(tree_path, 'rb') as file:
+            tree = pickle.load(file)
+    _loaded_references[points_path] = (points, tree)
+    return points, tree
+
+if __name__ == '__main__':
+    # python ReferenceCache.py <vtk_dir or zip> <cache_dir>
+    print(str(BuildReferenceCache(sys.argv[1], sys.argv[2])) + " reference centerlines cached")
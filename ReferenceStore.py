@@ -0,0 +1,103 @@
+import os
+import io
+import time
+import zipfile
+import threading
+import FileUtils
+import functools
+import collections
+import PCL_COMPARE
+
+# number of parsed reference centerlines kept in memory per store
+REFERENCE_LRU_SIZE = 8
+REFERENCE_SUFFIX = '.vtk'
+
+class ReferenceStore:
+    # Reference centerline vtks in a directory or a zip archive. The directory listing or the
+    # zip central directory is indexed once by lower-cased case name, members are parsed straight
+    # from the archive when a case asks for them.
+
+    def __init__(self, source, lru_size=REFERENCE_LRU_SIZE):
+        self.source = source
+        self.lru_size = lru_size
+        self.lock = threading.Lock()
+        self.parsed = collections.OrderedDict()
+        self.archive = None
+        self.index = {}
+
+        if zipfile.is_zipfile(source):
+            self.archive = zipfile.ZipFile(source)
+            for info in self.archive.infolist():
+                name = os.path.basename(info.filename)
+                if not info.is_dir() and name.lower().endswith(REFERENCE_SUFFIX):
+                    self.index[name[:-len(REFERENCE_SUFFIX)].lower()] = info
+        elif os.path.isdir(source):
+            for root, dirs, files in os.walk(source):
+                for name in files:
+                    if name.lower().endswith(REFERENCE_SUFFIX):
+                        self.index.setdefault(name[:-len(REFERENCE_SUFFIX)].lower(), os.path.join(root, name))
+
+    def Cases(self):
+        return list(self.index)
+
+    def Contains(self, case_name):
+        return case_name.lower() in self.index
+
+    # modification time of a reference, used to invalidate caches built from it
+    def GetMtime(self, case_name):
+        entry = self.index[case_name.lower()]
+        if self.archive is not None:
+            return time.mktime(entry.date_time + (0, 0, -1))
+        return os.path.getmtime(entry)
+
+    # file path of a reference, or its member name in the zip archive
+    def GetEntryName(self, case_name):
+        entry = self.index[case_name.lower()]
+        return entry.filename if self.archive is not None else entry
+
+    # open a reference as a text stream without extracting it
+    def Open(self, case_name):
+        entry = self.index[case_name.lower()]
+        if self.archive is not None:
+            return io.TextIOWrapper(self.archive.open(entry), encoding='ascii', errors='replace')
+        return open(entry)
+
+    # parse a reference without touching the LRU
+    def ReadPoints(self, case_name):
+        with self.Open(case_name) as stream:
+            return PCL_COMPARE.ReadVtkPoints(stream)
+
+    # parsed points of a reference, the most recently used ones stay in memory
+    def GetPoints(self, case_name):
+        key = case_name.lower()
+        with self.lock:
+            if key in self.parsed:
+                self.parsed.move_to_end(key)
+                return self.parsed[key]
+
+        points = self.ReadPoints(case_name)
+        with self.lock:
+            self.parsed[key] = points
+            self.parsed.move_to_end(key)
+            while len(self.parsed) > self.lru_size:
+                self.parsed.popitem(last=False)
+        return points
+
+    # path of a reference on disk for tools that need a file, zip members are extracted to extract_dir
+    def GetPath(self, case_name, extract_dir):
+        entry = self.index[case_name.lower()]
+        if self.archive is None:
+            return entry
+
+        vtk_path = os.path.join(extract_dir, os.path.basename(entry.filename))
+        if not os.path.isfile(vtk_path):
+            if not os.path.exists(extract_dir):
+                os.makedirs(extract_dir, exist_ok=True)
+            with self.archive.open(entry) as member:
+                FileUtils.AtomicWrite(vtk_path, lambda file: file.write(member.read()), 'wb')
+        return vtk_path
+
+# one store per source for the lifetime of the process
+@functools.lru_cache(maxsize=None)
+def OpenReferenceStore(source):
+    return ReferenceStore(source)
@@ -0,0 +1,149 @@
+import os
+import sys
+import json
+import shutil
+import hashlib
+import threading
+import FileUtils
+
+# Content addressed cache of skeletonization results. An entry is keyed by the STL content hash,
+# the (quantized) launch file parameters and the executable hash, and holds the SkeletonData json
+# and the metrics computed from it. Entry mtimes are refreshed on every hit for LRU eviction.
+# The bytes of all entries are tracked in TOTAL_NAME, updated under its lock on every store, and the
+# entries are only walked for eviction once the total goes over the budget (or by running this module).
+
+SKELETON_DATA_NAME = 'SkeletonData.json'
+METRICS_NAME = 'metrics.json'
+TOTAL_NAME = 'total_bytes.txt'
+# an eviction triggered by a store frees down to this fraction of the budget so the next stores do not walk again
+EVICT_LOW_WATER = 0.8
+HASH_CHUNK = 1 << 20
+
+# file hashes already computed by this process, keyed by (path, size, mtime)
+_file_hashes = {}
+_file_hashes_lock = threading.Lock()
+
+def FileHash(path):
+    if not os.path.isfile(path):
+        return 'missing:' + path
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _file_hashes_lock:
+        if memo_key in _file_hashes:
+            return _file_hashes[memo_key]
+
+    sha = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK), b''):
+            sha.update(chunk)
+    with _file_hashes_lock:
+        _file_hashes[memo_key] = sha.hexdigest()
+    return _file_hashes[memo_key]
+
+# parameters as strings with the listed ones rounded to their quantization step
+def QuantizeParameters(params, quantization):
+    quantized = {}
+    for key in params:
+        value = params[key]
+        step = quantization.get(key, 0)
+        if step:
+            value = round(round(float(value) / step) * step, 10)
+        quantized[key] = str(value)
+    return quantized
+
+# stl_hash is the FileHash of the STL when it is already known, e.g. from the case manifest
+def CacheKey(stl_path, params, exe_path, quantization, stl_hash=None):
+    key_data = {
+        'stl': stl_hash or FileHash(stl_path),
+        'params': QuantizeParameters(params, quantization),
+        'exe': FileHash(exe_path),
+    }
+    return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode()).hexdigest()
+
+def EntryDir(cache_dir, key):
+    return os.path.join(cache_dir, key[:2], key)
+
+# returns (skeleton data json path, metrics) of a cached result, None on a miss
+def Lookup(cache_dir, key):
+    entry_dir = EntryDir(cache_dir, key)
+    json_path = os.path.join(entry_dir, SKELETON_DATA_NAME)
+    try:
+        with open(os.path.join(entry_dir, METRICS_NAME)) as metrics_file:
+            metrics = json.load(metrics_file)
+        os.utime(entry_dir)
+    except (OSError, ValueError):
+        return None
+    if not os.path.isfile(json_path):
+        return None
+    return json_path, metrics
+
+def Store(cache_dir, key, json_path, metrics, max_bytes):
+    entry_dir = EntryDir(cache_dir, key)
+    if os.path.isdir(entry_dir):
+        return
+
+    # fill a private directory then rename it so readers never see a partial entry
+    tmp_dir = FileUtils.TempPath(entry_dir)
+    os.makedirs(tmp_dir, exist_ok=True)
+    shutil.copyfile(json_path, os.path.join(tmp_dir, SKELETON_DATA_NAME))
+    with open(os.path.join(tmp_dir, METRICS_NAME), 'w') as metrics_file:
+        json.dump(metrics, metrics_file)
+    entry_size = FileUtils.DirSize(tmp_dir)
+    try:
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        # another trial stored the same result first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return
+
+    total_path = os.path.join(cache_dir, TOTAL_NAME)
+    with FileUtils.FileLock(total_path):
+        total_size = ReadTotal(total_path)
+        if total_size is None and not max_bytes:
+            return
+        if total_size is None or total_size + entry_size > max_bytes > 0:
+            EvictEntries(cache_dir, int(max_bytes * EVICT_LOW_WATER), total_path)
+        else:
+            FileUtils.AtomicWrite(total_path, lambda total_file: total_file.write(str(total_size + entry_size)))
+
+# tracked bytes of the cache, None when they are not known yet
+def ReadTotal(total_path):
+    try:
+        with open(total_path) as total_file:
+            return int(total_file.read())
+    except (OSError, ValueError):
+        return None
+
+# remove least recently used entries until the cache fits in max_bytes (0 only measures it)
+def Evict(cache_dir, max_bytes):
+    total_path = os.path.join(cache_dir, TOTAL_NAME)
+    with FileUtils.FileLock(total_path):
+        EvictEntries(cache_dir, max_bytes, total_path)
+
+# Evict with the lock of total_path held, the measured total replaces the tracked one
+def EvictEntries(cache_dir, max_bytes, total_path):
+    entries = []
+    for prefix in os.listdir(cache_dir):
+        prefix_dir = os.path.join(cache_dir, prefix)
+        if not os.path.isdir(prefix_dir):
+            continue
+        for name in os.listdir(prefix_dir):
+            entry_dir = os.path.join(prefix_dir, name)
+            if name.endswith('.tmp'):
+                continue
+            try:
+                entries.append((os.path.getmtime(entry_dir), FileUtils.DirSize(entry_dir), entry_dir))
+            except OSError:
+                pass
+
+    total_size = sum(entry[1] for entry in entries)
+    for mtime, size, entry_dir in sorted(entries):
+        if not max_bytes or total_size <= max_bytes:
+            break
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        total_size -= size
+    FileUtils.AtomicWrite(total_path, lambda total_file: total_file.write(str(total_size)))
+
+if __name__ == '__main__':
+    # python ResultCache.py <cache_dir> <max_bytes>
+    Evict(sys.argv[1], int(sys.argv[2]))
@@ -0,0 +1,193 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+
+# Indexed results of an experiment in one SQLite database (WAL mode) next to the csv reports.
+# Concurrent trials write to it safely: WAL lets readers run next to the one writer and writers wait
+# for each other through the busy timeout. A trial buffers its case rows and stage timings and writes
+# them in batches, the whole trial is committed with its summary at the end. Case rows keep the proxy
+# fidelity of their trial (0 = full resolution meshes), only full resolution cases are compared.
+#   python ResultsStore.py <experiment_dir>/Results.sqlite best-per-case
+#   python ResultsStore.py <experiment_dir>/Results.sqlite top --k 5
+#   python ResultsStore.py <experiment_dir>/Results.sqlite export <csv_dir>
+
+DB_FILE = "Results.sqlite"
+BUSY_TIMEOUT = 60
+BATCH_SIZE = 50
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS experiments (
+    experiment_id TEXT PRIMARY KEY,
+    name TEXT,
+    created REAL
+);
+CREATE TABLE IF NOT EXISTS trials (
+    experiment_id TEXT,
+    trial_id TEXT,
+    params TEXT,
+    status TEXT,
+    default_score REAL,
+    passed_cases INTEGER,
+    cases_evaluated INTEGER,
+    wall_time REAL,
+    summary TEXT,
+    finished REAL,
+    PRIMARY KEY (experiment_id, trial_id)
+);
+CREATE TABLE IF NOT EXISTS cases (
+    experiment_id TEXT,
+    trial_id TEXT,
+    case_index INTEGER,
+    case_name TEXT,
+    passed INTEGER,
+    score REAL,
+    total_time REAL,
+    case_wall_time REAL,
+    metrics TEXT,
+    fidelity INTEGER DEFAULT 0,
+    PRIMARY KEY (experiment_id, trial_id, case_name)
+);
+CREATE INDEX IF NOT EXISTS cases_by_case ON cases (case_name, passed, score);
+CREATE TABLE IF NOT EXISTS stage_timings (
+    experiment_id TEXT,
+    trial_id TEXT,
+    case_name TEXT,
+    stage TEXT,
+    wall_time REAL,
+    cpu_time REAL
+);
+CREATE INDEX IF NOT EXISTS stage_timings_by_trial ON stage_timings (experiment_id, trial_id);
+'''
+
+# numpy scalars in metrics are stored as plain numbers
+def JsonValue(value):
+    return value.item() if hasattr(value, 'item') else str(value)
+
+def ScoreValue(value):
+    return None if value is None else float(value)
+
+def Connect(db_path):
+    connection = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.executescript(SCHEMA)
+    AddMissingColumns(connection)
+    return connection
+
+# columns added to the schema after a store was created
+ADDED_COLUMNS = (("cases", "fidelity", "INTEGER DEFAULT 0"),)
+
+def AddMissingColumns(connection):
+    for table, column, column_type in ADDED_COLUMNS:
+        if column not in [row[1] for row in connection.execute("PRAGMA table_info(" + table + ")")]:
+            try:
+                with connection:
+                    connection.execute("ALTER TABLE " + table + " ADD COLUMN " + column + " " + column_type)
+            except sqlite3.OperationalError:
+                # another trial added it first
+                pass
+
+class ResultsStore:
+    # Writer for the results of one trial, case rows and timings are buffered and
+    # inserted batch_size at a time.
+
+    def __init__(self, db_path, experiment_id, trial_id, batch_size=BATCH_SIZE, fidelity=0):
+        self.connection = Connect(db_path)
+        self.experiment_id = experiment_id
+        self.trial_id = trial_id
+        self.fidelity = fidelity
+        self.batch_size = batch_size
+        self.case_rows = []
+        self.timing_rows = []
+
+    def AddExperiment(self, name):
+        with self.connection:
+            self.connection.execute("INSERT OR IGNORE INTO experiments VALUES (?, ?, ?)", (self.experiment_id, name, time.time()))
+
+    def AddCase(self, case_index, case_name, case_metrics, score_key, case_timings=None):
+        self.case_rows.append((self.experiment_id, self.trial_id, case_index, case_name, int(case_metrics["passed"]),
+                               ScoreValue(case_metrics.get(score_key)), ScoreValue(case_metrics.get("total_time")),
+                               ScoreValue(case_metrics.get("case_wall_time")), json.dumps(case_metrics, default=JsonValue),
+                               self.fidelity))
+        for stage, times in (case_timings or {}).items():
+            self.timing_rows.append((self.experiment_id, self.trial_id, case_name, stage, times[0], times[1]))
+        if len(self.case_rows) >= self.batch_size:
+            self.Flush()
+
+    def Flush(self):
+        if not self.case_rows and not self.timing_rows:
+            return
+        with self.connection:
+            self.WriteBuffered()
+
+    def WriteBuffered(self):
+        self.connection.executemany("INSERT OR REPLACE INTO cases VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", self.case_rows)
+        self.connection.executemany("INSERT INTO stage_timings VALUES (?, ?, ?, ?, ?, ?)", self.timing_rows)
+        self.case_rows = []
+        self.timing_rows = []
+
+    # write the remaining cases and the trial summary in one transaction
+    def FinishTrial(self, params, summary, passed_cases):
+        with self.connection:
+            self.WriteBuffered()
+            self.connection.execute("INSERT OR REPLACE INTO trials VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                    (self.experiment_id, self.trial_id, json.dumps(params, default=JsonValue), summary.get("status"),
+                                     ScoreValue(summary.get("default")), passed_cases, summary.get("cases_evaluated"),
+                                     ScoreValue(summary.get("trial_wall_time")), json.dumps(summary, default=JsonValue), time.time()))
+
+    def Close(self):
+        self.Flush()
+        self.connection.close()
+
+# best passed full resolution trial of every case: (case_name, trial_id, score)
+def BestTrialPerCase(connection, optimize_mode="minimize"):
+    best = "MAX" if optimize_mode == "maximize" else "MIN"
+    return connection.execute("SELECT case_name, trial_id, " + best + "(score) FROM cases "
+                              "WHERE passed = 1 AND score IS NOT NULL AND fidelity = 0 GROUP BY case_name ORDER BY case_name").fetchall()
+
+# the k best complete trials: (trial_id, default_score, params)
+def TopTrials(connection, k, optimize_mode="minimize"):
+    order = "DESC" if optimize_mode == "maximize" else "ASC"
+    return connection.execute("SELECT trial_id, default_score, params FROM trials WHERE status = 'complete' "
+                              "ORDER BY default_score " + order + " LIMIT ?", (k,)).fetchall()
+
+# csv views of the store: Trials.csv, Cases.csv and Stage_Timings.csv in output_dir
+def ExportCsv(connection, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    for table, file_name in (("trials", "Trials.csv"), ("cases", "Cases.csv"), ("stage_timings", "Stage_Timings.csv")):
+        cursor = connection.execute("SELECT * FROM " + table)
+        with open(os.path.join(output_dir, file_name), "w") as csv_file:
+            csv_file.write(", ".join(column[0] for column in cursor.description) + "\n")
+            for row in cursor:
+                csv_file.write(",".join(CsvValue(value) for value in row) + "\n")
+
+def CsvValue(value):
+    value = "" if value is None else str(value)
+    if ',' in value or '"' in value:
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Query the results store of an experiment")
+    parser.add_argument("db_path")
+    parser.add_argument("command", choices=["best-per-case", "top", "export"])
+    parser.add_argument("output_dir", nargs="?", default=".", help="csv directory for export")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--optimize-mode", default="minimize", choices=["minimize", "maximize"])
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.db_path):
+        sys.exit(args.db_path + " does not exist")
+    connection = Connect(args.db_path)
+    if args.command == "best-per-case":
+        for case_name, trial_id, score in BestTrialPerCase(connection, args.optimize_mode):
+            print(case_name + "," + trial_id + "," + str(score))
+    elif args.command == "top":
+        for trial_id, default_score, params in TopTrials(connection, args.k, args.optimize_mode):
+            print(trial_id + "," + str(default_score) + "," + params)
+    else:
+        ExportCsv(connection, args.output_dir)
+        print("Exported to " + args.output_dir)
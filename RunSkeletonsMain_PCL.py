@@ -1,21 +1,137 @@
 import os
 import fnmatch
 import time
-import subprocess
 import json
 import shutil
+import threading
+import collections
+import numpy as np
 import nni
 import SKJson2VTk
+import ResultCache
+import TrialPruning
+import SuccessiveHalving
+import StageTimer
+import ProcessRunner
+import CaseTimeouts
+import WorkerService
+import ResultsStore
+import ColumnarExport
+import TimeObjective
+import CaseManifest
+import CaseScheduler
+import StlProxies
+import TrialRetention
+import FileUtils
 import PCL_COMPARE
+import ReferenceCache
+import ReferenceStore
 
 # Constants
 OUTPUT_DIR = "."
 INPUT_STL_DIR = "C:\\Users\\mcitrin\\Documents\\python_scripts\\AAA_NNI\\VMTK_COMPARE_STLS"
-VMTK_VTKS_DIR = "C:\\Users\\mcitrin\\Documents\\python_scripts\\AAA_NNI\\VMTK_CERTERLINE_VTKS_ASCII"
+# directory or zip archive of the reference VMTK centerlines
+VMTK_VTKS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "VMTK_CERTERLINE_VTKS_ASCII.zip")
 EXPERIMENT_NAME = "RUN_TUSEDAYTEST_11-7_PCL_TEST"
+# preprocessed VMTK_VTKS_DIR centerlines shared by all trials, see ReferenceCache.py
+REFERENCE_CACHE_DIR = os.path.join(OUTPUT_DIR, "reference_cache")
 SEARCH_SPACE_JSON = "C:\\Users\\mcitrin\\Documents\\python_scripts\\AAA_NNI\\Skeletonization\\search_space.json"
-SKELETONIZE_EXE = "C:\\Users\\mcitrin\\Documents\\Submodule_Test\\build\\submodules\\Release\\SK_Lite.exe"
+# SKELETONIZE_EXE in the environment overrides the path, e.g. with MockSkLite.py on machines without SK_Lite
+SKELETONIZE_EXE = os.environ.get("SKELETONIZE_EXE", "C:\\Users\\mcitrin\\Documents\\Submodule_Test\\build\\submodules\\Release\\SK_Lite.exe")
 SKETLTON_TIMEOUT = 180
+CONFIG_YML = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.yml")
+
+# per case timeouts from the runtimes of earlier trials: percentile * factor clamped to [floor, ceiling],
+# cases with fewer than min samples passed runs use SKETLTON_TIMEOUT
+ADAPTIVE_TIMEOUT_ENABLED = True
+ADAPTIVE_TIMEOUT_PERCENTILE = 95
+ADAPTIVE_TIMEOUT_FACTOR = 3
+ADAPTIVE_TIMEOUT_FLOOR = 20
+ADAPTIVE_TIMEOUT_CEILING = 600
+ADAPTIVE_TIMEOUT_MIN_SAMPLES = 5
+# number of cases skeletonized at once in a trial, 0 = cpu count shared between concurrent trials
+CASE_WORKERS = 0
+# start the cases with the longest predicted runtime first (from past runtimes and mesh size) so the
+# trial is not held up by a big mesh started last, reports keep the case order, see CaseScheduler.py
+LONGEST_FIRST_SCHEDULING = True
+# address of a running WorkerService.py (socket path or host:port) that runs the cases of all
+# concurrent trials on one shared pool, empty or unreachable runs them in a local pool
+WORKER_SERVICE_ADDRESS = os.environ.get("WORKER_SERVICE_ADDRESS", "")
+# settings run_case depends on, the worker service runs the cases of a trial with the trial's values
+CASE_SETTINGS = ["SKELETONIZE_EXE", "SKETLTON_TIMEOUT", "RESULT_CACHE_ENABLED", "RESULT_CACHE_DIR", "RESULT_CACHE_MAX_BYTES",
+                 "RESULT_CACHE_QUANTIZATION", "EXPORT_VTKS_DURING_SEARCH", "TIMING_ENABLED",
+                 "VMTK_VTKS_DIR", "REFERENCE_CACHE_DIR"]
+
+# skeletonization results reused across trials, see ResultCache.py
+RESULT_CACHE_ENABLED = True
+RESULT_CACHE_DIR = os.path.join(OUTPUT_DIR, "result_cache")
+RESULT_CACHE_MAX_BYTES = 20 * 1024**3
+# parameter sets closer than these steps share cache entries
+RESULT_CACHE_QUANTIZATION = {
+    "QualitySpeedTradeoff": 0.01,
+    "MedialSpeedTradeoff": 0.01,
+    "MinEdgeLength": 0.005,
+}
+
+# per case score used to compare trials part way through
+CASE_SCORE_KEY = "pcl_score"
+# stop a trial when the running mean of its case scores is worse than this percentile of the
+# completed trials at the same case index, the final result is then penalized, see TrialPruning.py
+EARLY_STOP_ENABLED = False
+EARLY_STOP_PERCENTILE = 50
+EARLY_STOP_MIN_TRIALS = 5
+EARLY_STOP_MIN_CASES = 3
+EARLY_STOP_PENALTY = 1.5
+# successive halving over the cases: trials run the first rung of cases and only the best 1/eta
+# of the trials at a rung continue to the next one (0 = all cases), see SuccessiveHalving.py
+FIDELITY_ENABLED = False
+FIDELITY_RUNGS = [4, 8, 0]
+FIDELITY_ETA = 3
+FIDELITY_MIN_TRIALS = 3
+# a trial that was not promoted only ran the first rungs, its score is penalized like an early stop
+NOT_PROMOTED_PENALTY = 1.5
+# screen parameter sets on decimated STLs with about PROXY_FIDELITY triangles per case (0 = the full
+# meshes), run such a screening as its own experiment (EXPERIMENT_NAME) so the tuner only compares
+# proxy scores with each other. A ProxyFidelity trial parameter overrides it for single trials, their
+# scores are not comparable with the full resolution trials and only reported to nni as intermediate
+# proxy_* results. Proxy trials are reported with status proxy and keep their own timeout, pruning and
+# rung history, see StlProxies.py
+PROXY_FIDELITY = 0
+STL_PROXY_DIR = os.path.join(OUTPUT_DIR, "stl_proxies")
+
+# objective reported as default, from the average case score and the average skeletonization time
+# of the passed cases: "quality" the score only, "weighted" adds OBJECTIVE_TIME_WEIGHT per second of average
+# skeletonization time, "budget" adds OBJECTIVE_BUDGET_PENALTY per 100% the average time is over
+# OBJECTIVE_TIME_BUDGET seconds, "pareto" reports the score and keeps the trials that are best for
+# their time in Pareto_Front.csv, see TimeObjective.py
+OBJECTIVE_MODE = "quality"
+OBJECTIVE_TIME_WEIGHT = 0.01
+OBJECTIVE_TIME_BUDGET = 60
+OBJECTIVE_BUDGET_PENALTY = 1.0
+
+# write vessel and centerline vtks for every case during the search, when off export them
+# afterwards for the selected trials with ExportTrialVtks.py
+EXPORT_VTKS_DURING_SEARCH = False
+
+# also write trials, cases and stage timings to <experiment>/Results.sqlite, see ResultsStore.py
+RESULTS_DB_ENABLED = True
+# add the trial's cases to the experiment's parquet dataset when pyarrow is installed, see ColumnarExport.py
+COLUMNAR_EXPORT_ENABLED = True
+
+# after every trial keep the input, output and vtk files of the RETENTION_TOP_K best trials and of all
+# failed cases, "compress" the others into <trial>/Artifacts.zip or "prune" them and delete archives of
+# the worst trials while the trials use more than RETENTION_MAX_BYTES, see TrialRetention.py
+RETENTION_ENABLED = True
+RETENTION_MODE = "compress"
+RETENTION_TOP_K = 10
+RETENTION_MAX_BYTES = 50 * 1024**3
+# run the retention pass in a detached process instead of before the trial exits
+RETENTION_IN_BACKGROUND = True
+
+# record wall and cpu time of every stage of every case to Trial_Timings.csv, see StageTimer.py
+TIMING_ENABLED = True
+# also send the stage times with nni.report_intermediate_result
+TIMING_REPORT_TO_NNI = False
 
 # Skeleton json keys
 vertices_key = 'SurfaceMeshVertices'
@@ -47,7 +163,12 @@ TRIAL_METRICS = {
     "termina": 0,
     "avg_degree": 0,
     "skeleton_length": 0,
-    "total_time": 0
+    "total_time": 0,
+    "peak_rss_mb": 0,
+    "child_cpu_time": 0,
+    "iterations": 0,
+    "case_wall_time": 0,
+    "overhead_time": 0
 }
 
 def Mkdir(dir):
@@ -70,13 +191,37 @@ def ParseJson(json_path):
     with open(json_path) as json_file:
         return json.load(json_file)
 
-# Get list of inputs files be they stls or skeleton data jsons
-def GetInputFiles(input_dir):  
-    input_directory_files = []
-    for file in sorted(os.listdir(input_dir)):
-        if file.endswith('.stl'):
-            input_directory_files.append(os.path.join(input_dir,file))
-    return input_directory_files  
+# returns the value of a key in the nni config, default if it is not set
+def ReadConfigValue(config_path, key, default):
+    if os.path.isfile(config_path):
+        with open(config_path) as config_file:
+            for line in config_file:
+                line_key, _, value = line.partition(':')
+                if line_key.strip() == key:
+                    return value.split('#')[0].strip()
+    return default
+
+# returns the trialConcurrency value of the nni config, 1 if it can not be read
+def ReadTrialConcurrency(config_path):
+    try:
+        return max(1, int(ReadConfigValue(config_path, 'trialConcurrency', 1)))
+    except ValueError:
+        return 1
+
+# number of cases a single trial runs at once
+def GetCaseWorkerCount(case_count):
+    workers = CASE_WORKERS
+    if workers <= 0:
+        workers = (os.cpu_count() or 1) // ReadTrialConcurrency(CONFIG_YML)
+    return max(1, min(workers, case_count))
+
+# the CASE_SETTINGS of this trial, directories as absolute paths
+def CaseSettings():
+    settings = {name: globals()[name] for name in CASE_SETTINGS}
+    for name in settings:
+        if name.endswith("_DIR"):
+            settings[name] = os.path.abspath(settings[name])
+    return settings
 
 def write_launch_file(file_name, case_name, input_path, output_path, params):
     with open(file_name, 'w') as file:
@@ -87,99 +232,87 @@ def write_launch_file(file_name, case_name, input_path, output_path, params):
             value = params[key]
             file.write(key + ' = ' + str(value).replace('*NAME*',case_name) + '\n')
 
-def RunSkeletonize(launchfile_path, exe_path):
+# stream SK_Lite output, the full log is kept in log_path when the run fails, on success it is
+# left in run_stats for the caller, see ProcessRunner.KeepLog
+# cancel_event kills the process once it is set
+def RunSkeletonize(launchfile_path, exe_path, log_path=None, echo_prefix=None, timeout=None, cancel_event=None):
     
+    timeout = timeout or SKETLTON_TIMEOUT
     start_time = time.time()
-    stdout_str = ""
-
-    with subprocess.Popen([exe_path, launchfile_path], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True) as p:
-        try:
-            stdout_data, _ = p.communicate(timeout=SKETLTON_TIMEOUT)
-            stdout_str += stdout_data
-            print(stdout_data, end='')  # This should preserve newlines as in the terminal
-            returncode = p.returncode
-        except subprocess.TimeoutExpired:
-            p.kill()
-            timeout_msg = f"The process took too long (more than {SKETLTON_TIMEOUT} seconds) and was terminated."
-            stdout_str += timeout_msg + "\n"
-            print(timeout_msg)
-            returncode = -1  # or whatever non-zero code you want to use to indicate timeout
-
-        total_time = time.time() - start_time
-        success = (returncode == 0)
-        return success, total_time, stdout_str
-    
-def euclidean_distance(p1, p2):
-    """Compute the Euclidean distance between two 3D points."""
-    return ((p1[0] - p2[0])**2 + (p1[1] - p2[1])**2 + (p1[2] - p2[2])**2)**0.5
-
-def polyline_length(polyline):
-    """Compute the length of a polyline."""
-    return sum(euclidean_distance(polyline[i], polyline[i+1]) for i in range(len(polyline) - 1))
-
-
-def ComputeRunMetrics(skeletonJsonData):
-    polylines = skeletonJsonData[polylines_key]
-
-    sk_points = []
-    raw_sk_points = skeletonJsonData[sk_points_key]
-    for i in range(int(len(raw_sk_points)/3)):
-        sk_points.append([raw_sk_points[i * 3 + 0],raw_sk_points[i * 3 + 1],raw_sk_points[i * 3 + 2]])  
-
-    bifurcations = {}
-    termina_cnt = 0 
+    returncode, stdout_str, run_stats = ProcessRunner.RunStreaming([exe_path, launchfile_path], timeout, log_path, echo_prefix,
+                                                                   cancel_event=cancel_event)
+
+    if run_stats["timed_out"]:
+        timeout_msg = f"The process took too long (more than {timeout} seconds) and was terminated."
+        stdout_str += timeout_msg + "\n"
+        print(timeout_msg)
+    elif run_stats["cancelled"]:
+        stdout_str += "The process was cancelled and terminated.\n"
+
+    total_time = time.time() - start_time
+    success = (returncode == 0)
+    return success, total_time, stdout_str, run_stats
+
+# child process measurements of a run for the reports
+def RunStatsMetrics(run_stats):
+    return {
+        "peak_rss_mb": (run_stats["peak_rss"] or 0) / 1024**2,
+        "child_cpu_time": run_stats["cpu_time"] or 0,
+        "iterations": run_stats["iterations"],
+    }
     
-    # List to store polylines that have both ends as bifurcations
-    polylines_between_bifurcations = []
+def segment_lengths(points, polyline_ids, polyline_offsets):
+    """Compute the length of every segment of the polylines, grouped by polyline."""
+    delta = np.diff(points[polyline_ids], axis=0)
+    lengths = np.sqrt(delta[:, 0]**2 + delta[:, 1]**2 + delta[:, 2]**2)
+    # drop the segments joining the end of one polyline to the start of the next
+    inner_offsets = polyline_offsets[1:-1]
+    return np.split(np.delete(lengths, inner_offsets - 1), inner_offsets - np.arange(1, len(inner_offsets) + 1))
+
+
+# skeleton is a SKJson2VTk.Skeleton or decoded skeleton json
+def ComputeRunMetrics(skeleton):
+    if not isinstance(skeleton, SKJson2VTk.Skeleton):
+        skeleton = SKJson2VTk.Skeleton.FromJsonData(skeleton)
+    polyline_ids = skeleton.polyline_ids
+    polyline_offsets = skeleton.polyline_offsets
+
+    start_points = skeleton.PolylineStarts()
+    end_points = skeleton.PolylineEnds()
+
+    # endpoint index built in one pass: number of polylines ending at each point id,
+    # and number of identical copies of each polyline (copies never count as neighbours)
+    end_degree = np.bincount(np.concatenate([start_points, end_points[end_points != start_points]]))
+    polyline_keys = [polyline.tobytes() for polyline in np.split(polyline_ids, polyline_offsets[1:-1])]
+    key_counts = collections.Counter(polyline_keys)
+    polyline_copies = np.array([key_counts[key] for key in polyline_keys], dtype=np.int64)
+
+    # an end is shared with another polyline if more polylines end there than copies of this one
+    start_is_bifurcation = end_degree[start_points] > polyline_copies
+    end_is_bifurcation = end_degree[end_points] > polyline_copies
+
+    bifurcations = np.unique(np.concatenate([start_points[start_is_bifurcation], end_points[end_is_bifurcation]]))
+    # if only one end is a bifurcation
+    termina_cnt = int(np.count_nonzero(start_is_bifurcation ^ end_is_bifurcation))
+    # polylines that have both ends as bifurcations
+    between_bifurcations = np.flatnonzero(start_is_bifurcation & end_is_bifurcation)
     skeleton_length = 0
 
-    # Loop through each polyline to check its ends
-    for current_polyline in polylines:
-        start_point = current_polyline[0]
-        end_point = current_polyline[-1]
-
-        start_is_bifurcation = False
-        end_is_bifurcation = False
-
-        # Check the current polyline's ends against the ends of all other polylines
-        for other_polyline in polylines:
-            if current_polyline == other_polyline:
-                continue
-
-            other_ends = [other_polyline[0], other_polyline[-1]]
-            if start_point in other_ends:
-                start_is_bifurcation = True
-            if end_point in other_ends:
-                end_is_bifurcation = True
-
-        if start_is_bifurcation:
-            bifurcations[start_point] = 0
-
-        if end_is_bifurcation:
-            bifurcations[end_point] = 0
-
-        if start_is_bifurcation and end_is_bifurcation:
-            polylines_between_bifurcations.append(current_polyline)
-
-        # if only one condition is true
-        if start_is_bifurcation ^ end_is_bifurcation:
-            termina_cnt += 1
-
-    sum_degree = 0
-    avg_degree = 0
-    # Loop over each bifurcation and find its degree
-    for bi in bifurcations:
-        for polyline in polylines:
-            if bi in polyline:
-                sum_degree += 1
+    # degree of a bifurcation is the number of polylines passing through it
+    polyline_of_id = np.repeat(np.arange(len(polyline_keys)), skeleton.PolylineLengths())
+    max_id = int(polyline_ids.max()) + 1 if len(polyline_ids) else 1
+    unique_ids = np.unique(polyline_of_id * max_id + polyline_ids.astype(np.int64)) % max_id
+    sum_degree = int(np.count_nonzero(np.isin(unique_ids, bifurcations)))
     avg_degree = sum_degree / len(bifurcations)
 
-    # Loop through each polyline to compute its length
-    for polyline_ids in polylines_between_bifurcations:
-        polyline = []
-        for id in polyline_ids:
-            polyline.append(sk_points[id])
-        skeleton_length += polyline_length(polyline)
+    # sum polyline lengths one polyline at a time to keep the reference summation order
+    if len(between_bifurcations):
+        lengths = skeleton.PolylineLengths()[between_bifurcations]
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(lengths)
+        ids = np.concatenate([skeleton.Polyline(i) for i in between_bifurcations])
+        for polyline_lengths in segment_lengths(skeleton.points[ids], np.arange(len(ids)), offsets):
+            skeleton_length += sum(polyline_lengths.tolist())
 
     out_metrics = TRIAL_METRICS.copy()
     out_metrics["bifurcations"] = len(bifurcations)
@@ -190,21 +323,47 @@ def ComputeRunMetrics(skeletonJsonData):
     return out_metrics
 
 # Main execution logic
-def main(args):
+# trial_id is given when running without nni, e.g. by EndToEndBenchmark.py
+def main(args, trial_id=None):
     experiment_id = nni.get_experiment_id()
-    trial_id = nni.get_trial_id()
+    trial_id = trial_id or nni.get_trial_id()
     experiment_dirs = setup_directories(experiment_id, trial_id)
     copy_search_space_json(experiment_dirs['experiment_main'], SEARCH_SPACE_JSON)
-    report_paths = create_reports(experiment_dirs)
-    input_stl_files = GetInputFiles(INPUT_STL_DIR)
-    trial_results = run_trial(input_stl_files, experiment_dirs, report_paths, args)
-    analize_trial(trial_results, report_paths['experiment'], trial_id, args)
+    fidelity = int(args.get("ProxyFidelity", PROXY_FIDELITY))
+    report_paths = create_reports(experiment_dirs, fidelity)
+    if PCL_COMPARE.PCL_COMPARE_MODE != "exe":
+        ReferenceCache.BuildReferenceCache(VMTK_VTKS_DIR, REFERENCE_CACHE_DIR)
+    # stls, hashes and references are indexed once per experiment, see CaseManifest.py
+    case_manifest = CaseManifest.LoadManifest(experiment_dirs['experiment_main'], INPUT_STL_DIR, VMTK_VTKS_DIR)
+    input_stl_files = CaseManifest.InputFiles(case_manifest)
+    trial_start_time = time.time()
+    results_store = None
+    if RESULTS_DB_ENABLED:
+        results_store = ResultsStore.ResultsStore(os.path.join(experiment_dirs['experiment_main'], ResultsStore.DB_FILE),
+                                                  experiment_id, trial_id, fidelity=fidelity)
+        results_store.AddExperiment(EXPERIMENT_NAME)
+    trial_results, trial_status = run_trial(input_stl_files, experiment_dirs, report_paths, args, results_store, case_manifest,
+                                            fidelity)
+    if fidelity and trial_status == "complete":
+        trial_status = "proxy"
+    trial_wall_time = time.time() - trial_start_time
+    analize_trial(trial_results, report_paths['experiment'], trial_id, args, trial_status, trial_wall_time, results_store,
+                  fidelity)
+    if results_store is not None:
+        results_store.Close()
+    if COLUMNAR_EXPORT_ENABLED:
+        ColumnarExport.ExportTrial(experiment_dirs['experiment_main'], trial_id)
+    if RETENTION_ENABLED:
+        retention = TrialRetention.StartRetention if RETENTION_IN_BACKGROUND else TrialRetention.ApplyRetention
+        retention(experiment_dirs['experiment_main'], RETENTION_TOP_K, RETENTION_MODE, RETENTION_MAX_BYTES,
+                  ReadConfigValue(CONFIG_YML, 'optimize_mode', 'minimize'))
 
 def setup_directories(experiment_id, trial_id):
     # Setup and return a dictionary of necessary directories...
 
      # working dirs
-    experiment_main_dir = os.path.join(OUTPUT_DIR,EXPERIMENT_NAME)
+    # absolute, the cases may run in the worker service with another working directory
+    experiment_main_dir = os.path.abspath(os.path.join(OUTPUT_DIR,EXPERIMENT_NAME))
     trial_main_dir = os.path.join(experiment_main_dir,trial_id)
     trial_input_dir = os.path.join(trial_main_dir,"input")
     trial_output_dir = os.path.join(trial_main_dir,"output")
@@ -232,21 +391,30 @@ def copy_search_space_json(dest_dir, search_space_path):
         shutil.copy(search_space_path, copy_ss_path)
     pass
 
-def create_reports(dirs):
+def create_reports(dirs, fidelity=0):
     # Create main and trial report file if it does not exist...
     main_report_path = os.path.join(dirs['experiment_main'],"Main_Report.csv")
-    if not os.path.isfile(main_report_path):
-        with open(main_report_path, "a") as txt_file:
-                 txt_file.write('Trial_Id, QST, MST, MinEL, Cases_Ran, default, avg_pcl_score, avg_bifurcations, avg_termina, avg_degree, avg_sk_len\n')
+    with FileUtils.FileLock(main_report_path):
+        if not os.path.isfile(main_report_path):
+            with open(main_report_path, "a") as txt_file:
+                txt_file.write('Trial_Id, QST, MST, MinEL, Cases_Ran, default, avg_pcl_score, avg_bifurcations, avg_termina, avg_degree, avg_sk_len, Cases_Evaluated, Status, Trial_Wall_Time, avg_overhead_time, Quality, Avg_Time, Objective_Mode, Fidelity\n')
 
     # create trial report
     trail_report_path = os.path.join(dirs['trial_main'],"Trial_Report.csv")
     with open(trail_report_path, "w") as txt_file:
-            txt_file.write('Case, passed, pcl_score, bifurcations, terminal_cnt, avg_degree, skeleton_length, Total_Time\n')
+            txt_file.write('Case, passed, pcl_score, bifurcations, terminal_cnt, avg_degree, skeleton_length, Total_Time, Peak_RSS_MB, Child_Cpu_Time, Iterations, Case_Wall_Time, Overhead_Time\n')
+
+    # per stage timings of every case
+    timings_path = os.path.join(dirs['trial_main'],"Trial_Timings.csv")
+    if TIMING_ENABLED:
+        StageTimer.CreateTimingsFile(timings_path)
 
     return {
         'experiment': main_report_path,
         'trial': trail_report_path,
+        'timings': timings_path,
+        # proxy trials are only ranked against trials at the same fidelity
+        'rung': os.path.join(dirs['experiment_main'],"Rung_Report.csv" if not fidelity else "Rung_Report_" + str(fidelity) + ".csv"),
     }
 
 def write_trial_data(txt_file_path, case_name, data):
@@ -259,11 +427,16 @@ def write_trial_data(txt_file_path, case_name, data):
                            str(data["termina"]) + "," + 
                            str(data["avg_degree"]) + "," + 
                            str(data["skeleton_length"]) + "," + 
-                           str(data["total_time"]) + '\n')
+                           str(data["total_time"]) + "," + 
+                           str(data["peak_rss_mb"]) + "," + 
+                           str(data["child_cpu_time"]) + "," + 
+                           str(data["iterations"]) + "," + 
+                           str(data["case_wall_time"]) + "," + 
+                           str(data["overhead_time"]) + '\n')
             
 def write_experiment_data(txt_file_path, trial_id, passed_cases, data):
-     # write case data to trial report        
-        with open(txt_file_path, "a") as txt_file:
+     # write trial data to the experiment report, under its lock as concurrent trials append to it
+        with FileUtils.FileLock(txt_file_path), open(txt_file_path, "a") as txt_file:
              txt_file.write(str(trial_id) + "," + 
                             str(data["QualitySpeedTradeoff"]) + "," + 
                             str(data["MedialSpeedTradeoff"]) + "," + 
@@ -274,10 +447,126 @@ def write_experiment_data(txt_file_path, trial_id, passed_cases, data):
                             str(data['avg_bifurcations']) + "," + 
                             str(data['avg_termina']) + "," + 
                             str(data['avg_degree']) + "," + 
-                            str(data['avg_sk_len']) + "\n")
+                            str(data['avg_sk_len']) + "," + 
+                            str(data['cases_evaluated']) + "," + 
+                            str(data['status']) + "," + 
+                            str(data['trial_wall_time']) + "," + 
+                            str(data['avg_overhead_time']) + "," + 
+                            str(data['quality']) + "," + 
+                            str(data['avg_time']) + "," + 
+                            str(data['objective_mode']) + "," + 
+                            str(data['fidelity']) + "\n")
 
         
-def run_trial(input_stl_files, dirs, report_paths, params):
+def run_case(input_file, dirs, trial_params, case_index, case_count, timeout=None, stl_hash=None, cancel_event=None):
+    # Skeletonize a single STL and compute its metrics, cancel_event stops the skeletonization...
+    print()
+    print("&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&")
+    print("-----------  " + str(case_index) +"/"+ str(case_count) + "  --------------")
+    print("&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&")
+    print()
+
+    case_timings = StageTimer.NewTimings(TIMING_ENABLED)
+    case_name = os.path.basename(input_file).split(".stl")[0]
+
+    skeleton_input_file = os.path.join(dirs["trial_input"],case_name + '.txt')
+    skeleton_output_dir = os.path.join(dirs["trial_output"],case_name)
+    skeleton_output_path = os.path.join(skeleton_output_dir,case_name)
+    run_log_file = os.path.join(skeleton_output_dir,case_name + "_stdout.txt")
+
+    # make output dir to avoid error when writing clean stl 
+    Mkdir(skeleton_output_dir)
+
+    # make skeleton launch file
+    with StageTimer.Stage(case_timings, "launch_file"):
+        write_launch_file(skeleton_input_file, case_name, input_file, skeleton_output_path, trial_params)
+
+    cache_key = None
+    cached_result = None
+    if RESULT_CACHE_ENABLED:
+        with StageTimer.Stage(case_timings, "cache_lookup"):
+            cache_key = ResultCache.CacheKey(input_file, trial_params, SKELETONIZE_EXE, RESULT_CACHE_QUANTIZATION, stl_hash)
+            cached_result = ResultCache.Lookup(RESULT_CACHE_DIR, cache_key)
+
+    if cached_result is not None:
+        # same stl, parameters and executable ran before, reuse its skeleton
+        skeletonData_file = os.path.join(skeleton_output_dir, case_name + '_SkeletonData.json')
+        try:
+            with StageTimer.Stage(case_timings, "cache_copy"):
+                shutil.copyfile(cached_result[0], skeletonData_file)
+        except OSError:
+            # evicted by another trial since the lookup, run the case as a miss
+            cached_result = None
+
+    if cached_result is not None:
+        print("Result cache hit for " + case_name)
+        run_pass, run_time, run_sdt_out = True, cached_result[1]["total_time"], ""
+        run_stats = None
+    else:
+        with StageTimer.Stage(case_timings, "skeletonize"):
+            run_pass, run_time, run_sdt_out, run_stats = RunSkeletonize(skeleton_input_file, SKELETONIZE_EXE, run_log_file,
+                                                                        "[" + case_name + "] ", timeout, cancel_event)
+        with StageTimer.Stage(case_timings, "find_output"):
+            # SK_Lite writes <OutputName>_SkeletonData.json, only search the output dir when it is not there
+            skeletonData_file = os.path.join(skeleton_output_dir, case_name + '_SkeletonData.json')
+            if not os.path.isfile(skeletonData_file):
+                skeletonData_file = findFile(skeleton_output_dir, case_name+'_SkeletonData.json')
+            # the full log of a run that exited cleanly is only dropped once its skeleton is found
+            if skeletonData_file != "NULL":
+                ProcessRunner.DiscardLog(run_stats)
+            else:
+                ProcessRunner.KeepLog(run_stats, run_log_file)
+
+    skeletonData = None
+    #TRIAL_METRICS = { "passed":0,"bifurcations": 0,"termina": 0,"avg_degree": 0,"skeleton_length": 0,"total_time": 0 }
+    case_metrics = TRIAL_METRICS.copy()
+
+    if run_pass and skeletonData_file != "NULL":
+        # decode the skeleton once for metrics, vtk export and comparison
+        with StageTimer.Stage(case_timings, "parse_json"):
+            skeletonData = SKJson2VTk.LoadSkeletonData(skeletonData_file)
+        if cached_result is not None:
+            case_metrics.update(cached_result[1])
+        else:
+            with StageTimer.Stage(case_timings, "metrics"):
+                case_metrics = ComputeRunMetrics(skeletonData)
+        case_metrics["passed"] = 1
+        case_metrics["total_time"] = run_time
+        if run_stats is not None:
+            case_metrics.update(RunStatsMetrics(run_stats))
+        if cache_key is not None and cached_result is None:
+            with StageTimer.Stage(case_timings, "cache_store"):
+                ResultCache.Store(RESULT_CACHE_DIR, cache_key, skeletonData_file, case_metrics, RESULT_CACHE_MAX_BYTES)
+        if EXPORT_VTKS_DURING_SEARCH:
+            with StageTimer.Stage(case_timings, "vtk_export"):
+                SKJson2VTk.WriteVesselAndCenterlineVtk(skeletonData, case_name, dirs["trial_vtk"])
+
+        with StageTimer.Stage(case_timings, "compare"):
+            reference = None
+            if PCL_COMPARE.PCL_COMPARE_MODE != "exe":
+                reference = ReferenceCache.LoadReference(REFERENCE_CACHE_DIR, case_name)
+            references = ReferenceStore.OpenReferenceStore(VMTK_VTKS_DIR)
+            if reference is not None:
+                case_metrics["pcl_score"] = PCL_COMPARE.PCL_COMPARE_2_REFERENCE(skeletonData.points, *reference)
+            elif references.Contains(case_name):
+                if PCL_COMPARE.PCL_COMPARE_MODE == "exe":
+                    vtk_file = references.GetPath(case_name, os.path.join(REFERENCE_CACHE_DIR, "vtk"))
+                    case_metrics["pcl_score"] = PCL_COMPARE.PCL_COMPARE_2_VMTK(skeletonData_file, vtk_file)
+                else:
+                    case_metrics["pcl_score"] = PCL_COMPARE.PCL_COMPARE_2_REFERENCE(skeletonData.points, references.GetPoints(case_name))
+
+    # if run failed keep std output, a failed process already left its full log
+    else:
+        case_metrics.update(RunStatsMetrics(run_stats))
+        if not os.path.isfile(run_log_file):
+            with open(run_log_file, 'w') as f:
+                f.write(run_sdt_out)
+
+    case_metrics["case_wall_time"] = StageTimer.TotalWallTime(case_timings)
+    case_metrics["overhead_time"] = StageTimer.TotalWallTime(case_timings, exclude=("skeletonize",))
+    return case_name, case_metrics, case_timings
+
+def run_trial(input_stl_files, dirs, report_paths, params, results_store=None, case_manifest=None, fidelity=0):
     # Run the trial for each STL file...
 
     trial_params = DEFAULT_PARAMETERS
@@ -286,60 +575,94 @@ def run_trial(input_stl_files, dirs, report_paths, params):
     trial_params["MinEdgeLength"] = params["MinEdgeLength"]
 
     trial_data = {}
-    current_case_index = 0
-    for input_file in input_stl_files:
-        
-        print()
-        print("&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&")
-        print("-----------  " + str(current_case_index) +"/"+ str(len(input_stl_files)) + "  --------------")
-        print("&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&&")
-        print()
-
-        case_name = os.path.basename(input_file).split(".stl")[0]
-
-        skeleton_input_file = os.path.join(dirs["trial_input"],case_name + '.txt')
-        skeleton_output_dir = os.path.join(dirs["trial_output"],case_name)
-        skeleton_output_path = os.path.join(skeleton_output_dir,case_name)
-
-        # make output dir to avoid error when writing clean stl 
-        Mkdir(skeleton_output_dir)
-
-        # make skeleton launch file
-        write_launch_file(skeleton_input_file, case_name, input_file, skeleton_output_path, trial_params)
-        run_pass, run_time, run_sdt_out = RunSkeletonize(skeleton_input_file, SKELETONIZE_EXE)
-        print(run_sdt_out)
-
-        
-        skeletonData_file = findFile(skeleton_output_dir, case_name+'_SkeletonData.json')
-        skeletonData = {}
-        #TRIAL_METRICS = { "passed":0,"bifurcations": 0,"termina": 0,"avg_degree": 0,"skeleton_length": 0,"total_time": 0 }
-        case_metrics = TRIAL_METRICS.copy()
-
-        if run_pass and skeletonData_file != "NULL":
-            skeletonData = ParseJson(skeletonData_file)
-            case_metrics = ComputeRunMetrics(skeletonData)
-            case_metrics["passed"] = 1
-            case_metrics["total_time"] = run_time
-            SKJson2VTk.WriteVesselAndCenterlineVtk(skeletonData_file, case_name, dirs["trial_vtk"])
-
-            vtk_file = findFile(VMTK_VTKS_DIR, case_name+'.vtk')
-            if vtk_file != "NULL":
-                case_metrics["pcl_score"] = PCL_COMPARE.PCL_COMPARE_2_VMTK(skeletonData_file, vtk_file)
-
-        # if run failed write std output
-        else:
-            run_error_log_file = os.path.join(skeleton_output_dir,case_name + "_stdout.txt")
-            with open(run_error_log_file, 'w') as f:
-                f.write(run_sdt_out)
-
-        write_trial_data(report_paths["trial"], case_name, case_metrics)
-        nni.report_intermediate_result(case_metrics)    
-
-        trial_data[case_name] = case_metrics
-        current_case_index += 1
-    return trial_data
-
-def analize_trial(trial_data, experiment_Report_path, trial_id, args):
+    trial_status = "complete"
+    case_count = len(input_stl_files)
+    # low fidelity trials run the same cases on decimated STLs
+    if fidelity:
+        input_stl_files = [StlProxies.CaseProxy(STL_PROXY_DIR, fidelity, CaseManifest.CaseName(input_file),
+                                                case_manifest["cases"][CaseManifest.CaseName(input_file)])
+                           for input_file in input_stl_files]
+    optimize_mode = ReadConfigValue(CONFIG_YML, 'optimize_mode', 'minimize')
+    if EARLY_STOP_ENABLED:
+        history = TrialPruning.LoadHistory(dirs['experiment_main'], report_paths['experiment'], CASE_SCORE_KEY,
+                                           os.path.basename(dirs['trial_main']), fidelity)
+        case_scores = []
+    case_timeouts = {}
+    timeout_history = None
+    if ADAPTIVE_TIMEOUT_ENABLED or LONGEST_FIRST_SCHEDULING:
+        timeout_history = CaseTimeouts.UpdateHistory(dirs['experiment_main'], report_paths['experiment'], fidelity=fidelity)
+    if ADAPTIVE_TIMEOUT_ENABLED:
+        case_timeouts = CaseTimeouts.CaseTimeoutsFromHistory(timeout_history, SKETLTON_TIMEOUT, ADAPTIVE_TIMEOUT_PERCENTILE,
+                                                             ADAPTIVE_TIMEOUT_FACTOR, ADAPTIVE_TIMEOUT_FLOOR,
+                                                             ADAPTIVE_TIMEOUT_CEILING, ADAPTIVE_TIMEOUT_MIN_SAMPLES)
+
+    # cases are run in rungs, without successive halving the only rung is the full case set
+    rung_sizes = [case_count]
+    if FIDELITY_ENABLED:
+        input_stl_files = SuccessiveHalving.OrderCases(input_stl_files)
+        rung_sizes = SuccessiveHalving.RungSizes(FIDELITY_RUNGS, case_count)
+
+    case_names = [CaseManifest.CaseName(input_file) for input_file in input_stl_files]
+    # the manifest hashes are those of the full resolution STLs
+    stl_hashes = [None if fidelity else CaseManifest.CaseHash(case_manifest, case_name) for case_name in case_names]
+    predicted_times = {}
+    if LONGEST_FIRST_SCHEDULING and case_manifest is not None:
+        predicted_times = CaseScheduler.PredictRuntimes(case_manifest, timeout_history["runtimes"])
+
+    cancel_event = threading.Event()
+    with WorkerService.CaseExecutor(WORKER_SERVICE_ADDRESS, __file__, GetCaseWorkerCount(case_count),
+                                     CaseSettings()) as executor:
+        case_futures = []
+        for rung, rung_size in enumerate(rung_sizes):
+            # start the rung longest first, the futures stay in case order for collecting
+            rung_cases = range(len(case_futures), rung_size)
+            rung_futures = {}
+            for case_index in CaseScheduler.LongestFirst(rung_cases, case_names, predicted_times):
+                rung_futures[case_index] = executor.submit(run_case, input_stl_files[case_index], dirs, trial_params, case_index,
+                                                           case_count, case_timeouts.get(case_names[case_index]),
+                                                           stl_hashes[case_index], cancel_event)
+            case_futures += [rung_futures[case_index] for case_index in rung_cases]
+
+            # collect in input order so reports do not depend on which case finishes first
+            for case_future in case_futures[len(trial_data):]:
+                case_name, case_metrics, case_timings = case_future.result()
+
+                write_trial_data(report_paths["trial"], case_name, case_metrics)
+                if TIMING_ENABLED:
+                    StageTimer.WriteTimings(report_paths["timings"], case_name, case_timings)
+                if results_store is not None:
+                    results_store.AddCase(len(trial_data), case_name, case_metrics, CASE_SCORE_KEY, case_timings)
+                if TIMING_REPORT_TO_NNI:
+                    nni.report_intermediate_result(dict(case_metrics, **StageTimer.TimingMetrics(case_timings)))
+                else:
+                    nni.report_intermediate_result(case_metrics)    
+
+                trial_data[case_name] = case_metrics
+
+                if EARLY_STOP_ENABLED:
+                    case_scores.append(case_metrics[CASE_SCORE_KEY] if case_metrics["passed"] else None)
+                    if TrialPruning.ShouldStop(case_scores, history, EARLY_STOP_PERCENTILE, EARLY_STOP_MIN_TRIALS,
+                                               EARLY_STOP_MIN_CASES, optimize_mode):
+                        print("Stopping trial after " + str(len(case_scores)) + " cases, it is behind the completed trials")
+                        # kill the running cases too, their results are not used
+                        cancel_event.set()
+                        for pending_future in case_futures:
+                            pending_future.cancel()
+                        trial_status = "early_stopped"
+                        break
+
+            if trial_status != "complete" or rung_size == case_count:
+                break
+            rung_score = SuccessiveHalving.RungScore(trial_data, CASE_SCORE_KEY)
+            if not SuccessiveHalving.Promote(report_paths['rung'], os.path.basename(dirs['trial_main']), rung, rung_size,
+                                             rung_score, FIDELITY_ETA, FIDELITY_MIN_TRIALS, optimize_mode):
+                print("Trial not promoted past " + str(rung_size) + " cases")
+                trial_status = "not_promoted"
+                break
+    return trial_data, trial_status
+
+def analize_trial(trial_data, experiment_Report_path, trial_id, args, trial_status="complete", trial_wall_time=0,
+                  results_store=None, fidelity=0):
     # Analize the trial results and write them to the trial report...
     sum_bifurcations = 0
     avg_bifurcations = 0
@@ -377,16 +700,53 @@ def analize_trial(trial_data, experiment_Report_path, trial_id, args):
         default_score = avg_pcl_score
     else:
         default_score = 1e+10
+
+    # the runtime of the passed cases counts against the score, depending on OBJECTIVE_MODE
+    optimize_mode = ReadConfigValue(CONFIG_YML, 'optimize_mode', 'minimize')
+    quality_score = default_score
+    avg_time = TimeObjective.AverageTime(trial_data)
+    if passed_cnt:
+        default_score = TimeObjective.Objective(default_score, avg_time, OBJECTIVE_MODE, optimize_mode, OBJECTIVE_TIME_WEIGHT,
+                                                OBJECTIVE_TIME_BUDGET, OBJECTIVE_BUDGET_PENALTY)
+
+    # a trial stopped early or not promoted only ran its first cases, make sure it never looks better than it is
+    penalty = {"early_stopped": EARLY_STOP_PENALTY, "not_promoted": NOT_PROMOTED_PENALTY}.get(trial_status)
+    if penalty and passed_cnt:
+        if optimize_mode == "maximize":
+            default_score /= penalty
+        else:
+            default_score *= penalty
                  
     # ------------------------------- Report -------------------------------
     # ----------------------------------------------------------------------
-    scores = {'default': default_score, 'avg_pcl_score': avg_pcl_score, 'avg_bifurcations': avg_bifurcations, 'avg_termina': avg_termina, 'avg_degree': avg_degree, 'avg_sk_len': avg_sk_len}
+    scores = {'default': default_score, 'avg_pcl_score': avg_pcl_score, 'avg_bifurcations': avg_bifurcations, 'avg_termina': avg_termina, 'avg_degree': avg_degree, 'avg_sk_len': avg_sk_len,
+              'quality': quality_score, 'avg_time': avg_time}
     report_data = scores.copy()
+    report_data["objective_mode"] = OBJECTIVE_MODE
+    report_data["fidelity"] = fidelity
     report_data["QualitySpeedTradeoff"] = args["QualitySpeedTradeoff"]
     report_data["MedialSpeedTradeoff"] = args["MedialSpeedTradeoff"]
     report_data["MinEdgeLength"] = args["MinEdgeLength"]
-    nni.report_final_result(scores)
+    # partial evaluations (early stopped or not promoted) ran fewer cases than the full set
+    report_data["cases_evaluated"] = len(trial_data)
+    report_data["status"] = trial_status
+    report_data["trial_wall_time"] = trial_wall_time
+    report_data["avg_overhead_time"] = sum(data["overhead_time"] for data in trial_data.values()) / max(1, len(trial_data))
+    if fidelity and "ProxyFidelity" in args:
+        # a proxy trial among full resolution trials, keep its score away from the tuner's default
+        proxy_scores = {'proxy_' + key: value for key, value in scores.items()}
+        proxy_scores['fidelity'] = fidelity
+        nni.report_intermediate_result(proxy_scores)
+    else:
+        nni.report_final_result(scores)
     write_experiment_data(experiment_Report_path, trial_id, passed_cnt, report_data)
+    if OBJECTIVE_MODE == "pareto":
+        front_path = os.path.join(os.path.dirname(experiment_Report_path), TimeObjective.PARETO_FRONT_FILE)
+        front = TimeObjective.UpdateParetoFront(experiment_Report_path, front_path, optimize_mode)
+        if any(front_trial[0] == str(trial_id) for front_trial in front):
+            print("Trial " + str(trial_id) + " is on the pareto front of quality and time")
+    if results_store is not None:
+        results_store.FinishTrial(args, report_data, passed_cnt)
     pass
 
 if __name__ == '__main__':
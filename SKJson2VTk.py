@@ -1,177 +1,171 @@
 import math
 import json
 import os
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 VERTICES_KEY = 'SurfaceMeshVertices'
 FACES_KEY = 'SurfaceMeshFaces'
 MATRIX_KEY = 'TransformationMatrix'
 SKPOINTS_KEY = 'SkPoints'
 SKEDGES_KEY = 'SkEdges'
+POLYLINES_KEY = 'Polylines'
+# point ids of polyline i are data[POLYLINES_KEY][offsets[i]:offsets[i + 1]]
+POLYLINE_OFFSETS_KEY = 'PolylineOffsets'
 
 # returns dictonary object of json
 def ParseJson(json_path):
+    if orjson is not None:
+        with open(json_path, 'rb') as json_file:
+            return orjson.loads(json_file.read())
     with open(json_path) as json_file:
         return json.load(json_file)
 
-def write_vtk_unstructured_grid_centerline(mesh_vertices, mesh_faces, filename):  
-    # Open file for writing
-    file = open(filename, "w")
+# returns the first row_size values of every row of flat or nested values as a contiguous rows x row_size array
+def ArrayRows(values, row_size, dtype):
+    values = np.asarray(values if values is not None else [], dtype=dtype)
+    if values.ndim != 2:
+        values = values.reshape(-1)
+        values = values[:len(values) // row_size * row_size].reshape(-1, row_size)
+    return np.ascontiguousarray(values[:, :row_size])
 
-    # Write header information
-    file.write("# vtk DataFile Version 3.0\n")
-    file.write("Unstructured Grid Example\n")
-    file.write("ASCII\n")
-    file.write("DATASET UNSTRUCTURED_GRID\n")
-    
-    all_points = []
-    all_cells = []
-    num_points = 0
-    
-    # mesh vertices
-    for vertex in mesh_vertices:
-        all_points.append([vertex[0],vertex[1],vertex[2]])
-        num_points += 1
-        
-    # mesh faces   
-    cnt = 0
-    for face in mesh_faces:
-        all_cells.append(face)
-        cnt += 1
-  
-        
-    # add points to vtk file 
-    file.write("POINTS " + str(num_points) + " float\n")
-    for vertex in all_points:
-        file.write(str(vertex[0]) + " " + str(vertex[1]) + " " + str(vertex[2]) + "\n")
-    
-    num_cells = len(all_cells)
-    num_cell_points = sum([len(cell) for cell in all_cells])
-    file.write("CELLS " + str(num_cells) + " " + str(num_cell_points + num_cells) + "\n")
-    
-    for cell in all_cells:
-        face = cell
-        num_face_vertices = len(face)
-        file.write(str(num_face_vertices) + " ")
-        for vertex_index in face:
-            file.write(str(vertex_index) + " ")
-        file.write("\n")
-    
-    # Write cell types
-    file.write("CELL_TYPES " + str(num_cells) + "\n")
-    for cell in all_cells:
-        face = cell
-        
-        num_face_vertices = len(face)
-        if num_face_vertices == 4:
-            # Quad
-            file.write("9\n")
-        elif num_face_vertices == 3:
-            # Triangle
-            file.write("5\n")
-        elif num_face_vertices == 2:
-            # Edge
-            file.write("3\n")
-        else:
-            raise ValueError("Invalid number of vertices for face")
-    
-    # Close file
-    file.close()
+class Skeleton:
+    # Skeleton data as contiguous numpy arrays instead of nested lists: float64 N x 3 skeleton
+    # points and M x 3 surface vertices, the json doubles exactly, int32 E x 2 edges and F x 3 triangles, and the polylines
+    # in CSR form, the point ids of polyline i are polyline_ids[polyline_offsets[i]:polyline_offsets[i + 1]].
+    # The accessors return views, nothing is copied for the writers, metrics and comparison.
 
+    __slots__ = ('points', 'edges', 'vertices', 'faces', 'polyline_ids', 'polyline_offsets', 'matrix')
 
-def write_vtk_unstructured_grid(mesh_vertices, mesh_faces, filename):  
-    # Open file for writing
-    file = open(filename, "w")
+    def __init__(self, points, edges, vertices, faces, polyline_ids, polyline_offsets, matrix=None):
+        self.points = points
+        self.edges = edges
+        self.vertices = vertices
+        self.faces = faces
+        self.polyline_ids = polyline_ids
+        self.polyline_offsets = polyline_offsets
+        self.matrix = matrix
 
-    # Write header information
-    file.write("# vtk DataFile Version 3.0\n")
-    file.write("Unstructured Grid Example\n")
-    file.write("ASCII\n")
-    file.write("DATASET UNSTRUCTURED_GRID\n")
-    
-    all_points = []
-    all_cells = []
-    num_points = 0
-    
-    # mesh vertices
-    for vertex in mesh_vertices:
-        all_points.append([vertex[0],vertex[1],vertex[2]])
-        num_points += 1
-        
-    # mesh faces   
-    cnt = 0
-    for face in mesh_faces:
-        all_cells.append(face)
-        cnt += 1
-  
-        
-    # add points to vtk file 
-    file.write("POINTS " + str(num_points) + " float\n")
-    for vertex in all_points:
-        file.write(str(vertex[0]) + " " + str(vertex[1]) + " " + str(vertex[2]) + "\n")
-    
-    num_cells = len(all_cells)
-    num_cell_points = sum([len(cell) for cell in all_cells])
-    file.write("CELLS " + str(num_cells) + " " + str(num_cell_points + num_cells) + "\n")
-    
-    for cell in all_cells:
-        face = cell
-        num_face_vertices = len(face)
-        file.write(str(num_face_vertices) + " ")
-        for vertex_index in face:
-            file.write(str(vertex_index) + " ")
-        file.write("\n")
-    
-    # Write cell types
-    file.write("CELL_TYPES " + str(num_cells) + "\n")
-    for cell in all_cells:
-        face = cell
-        
-        num_face_vertices = len(face)
-        if num_face_vertices == 4:
-            # Quad
-            file.write("9\n")
-        elif num_face_vertices == 3:
-            # Triangle
-            file.write("5\n")
-        elif num_face_vertices == 2:
-            # Edge
-            file.write("3\n")
-        else:
+    # from a decoded skeleton data json (flat or nested arrays, nested polylines)
+    @classmethod
+    def FromJsonData(cls, skeleton_data):
+        polylines = skeleton_data.get(POLYLINES_KEY, [])
+        if isinstance(polylines, np.ndarray) and polylines.ndim == 2:
+            polylines = polylines.tolist()
+        offsets = np.zeros(len(polylines) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(polyline) for polyline in polylines])
+        ids = np.fromiter((point_id for polyline in polylines for point_id in polyline), dtype=np.int32, count=offsets[-1])
+        matrix = skeleton_data.get(MATRIX_KEY)
+        return cls(ArrayRows(skeleton_data.get(SKPOINTS_KEY), 3, np.float64),
+                   ArrayRows(skeleton_data.get(SKEDGES_KEY), 2, np.int32),
+                   ArrayRows(skeleton_data.get(VERTICES_KEY), 3, np.float64),
+                   ArrayRows(skeleton_data.get(FACES_KEY), 3, np.int32),
+                   ids, offsets,
+                   np.asarray(matrix, dtype=np.float64) if matrix is not None and len(matrix) else None)
+
+    @classmethod
+    def Load(cls, json_path):
+        return cls.FromJsonData(ParseJson(json_path))
+
+    def PolylineLengths(self):
+        return np.diff(self.polyline_offsets)
+
+    def Polyline(self, index):
+        return self.polyline_ids[self.polyline_offsets[index]:self.polyline_offsets[index + 1]]
+
+    def PolylineStarts(self):
+        return self.polyline_ids[self.polyline_offsets[:-1]]
+
+    def PolylineEnds(self):
+        return self.polyline_ids[self.polyline_offsets[1:] - 1]
+
+# decode a skeleton data json once into a Skeleton shared by metrics, vtk export and comparison
+def LoadSkeletonData(json_path):
+    return Skeleton.Load(json_path)
+
+# vtk cell type for the number of vertices in a face: edge, triangle, quad
+VTK_CELL_TYPES = {2: 3, 3: 5, 4: 9}
+
+# returns a flat list with the first row_size values of every row,
+# rows can be given as nested lists, a flat list or a numpy array
+def FlattenRows(values, row_size):
+    if isinstance(values, np.ndarray):
+        return ArrayRows(values, row_size, values.dtype).reshape(-1).tolist()
+    if len(values) and isinstance(values[0], (list, tuple)):
+        return [value for row in values for value in row[:row_size]]
+    return values[:len(values) - len(values) % row_size]
+
+def write_vtk_unstructured_grid(mesh_vertices, mesh_faces, filename, face_size=None):
+    # mesh_vertices / mesh_faces are nested lists or flat lists / numpy arrays, for flat faces
+    # face_size gives the number of vertices per face. Each section is formatted into one buffer
+    # with str.format, which prints every value exactly as str() does.
+    if face_size is None and hasattr(mesh_faces, 'tolist'):
+        mesh_faces = mesh_faces.tolist()
+    if face_size is None:
+        face_sizes = set(len(face) for face in mesh_faces)
+        face_size = face_sizes.pop() if len(face_sizes) == 1 else None
+    else:
+        face_sizes = set()
+
+    if face_size is not None:
+        # every face has the same number of vertices
+        if face_size not in VTK_CELL_TYPES:
             raise ValueError("Invalid number of vertices for face")
-    
-    # Close file
-    file.close()
+        face_values = FlattenRows(mesh_faces, face_size)
+        num_cells = len(face_values) // face_size
+        num_cell_points = len(face_values)
+        cells_text = ((str(face_size) + " " + "{} " * face_size + "\n") * num_cells).format(*face_values)
+        cell_types_text = (str(VTK_CELL_TYPES[face_size]) + "\n") * num_cells
+    else:
+        # mixed faces
+        if not face_sizes.issubset(VTK_CELL_TYPES):
+            raise ValueError("Invalid number of vertices for face")
+        num_cells = len(mesh_faces)
+        num_cell_points = sum(len(face) for face in mesh_faces)
+        cells_text = "".join((str(len(face)) + " " + "{} " * len(face) + "\n").format(*face) for face in mesh_faces)
+        cell_types_text = "".join(str(VTK_CELL_TYPES[len(face)]) + "\n" for face in mesh_faces)
+
+    vertex_values = FlattenRows(mesh_vertices, 3)
+    num_points = len(vertex_values) // 3
+
+    with open(filename, "w") as file:
+        # Write header information
+        file.write("# vtk DataFile Version 3.0\n")
+        file.write("Unstructured Grid Example\n")
+        file.write("ASCII\n")
+        file.write("DATASET UNSTRUCTURED_GRID\n")
+
+        # add points to vtk file 
+        file.write("POINTS " + str(num_points) + " float\n")
+        file.write(("{} {} {}\n" * num_points).format(*vertex_values))
 
+        file.write("CELLS " + str(num_cells) + " " + str(num_cell_points + num_cells) + "\n")
+        file.write(cells_text)
+
+        # Write cell types
+        file.write("CELL_TYPES " + str(num_cells) + "\n")
+        file.write(cell_types_text)
+
+def write_vtk_unstructured_grid_centerline(mesh_vertices, mesh_faces, filename, face_size=None):
+    write_vtk_unstructured_grid(mesh_vertices, mesh_faces, filename, face_size)
+
+# returns the surface vertices, faces, skeleton points and edges of a skeleton data json as
+# rows x 3 (edges rows x 2) arrays, views of its Skeleton
 def ParseDataFromJsons(skeleton_json_path):
-    skeleton_data = ParseJson(skeleton_json_path)
-    
-    mesh_vertices = []
-    raw_vertices = skeleton_data[VERTICES_KEY]
-    for i in range(int(len(raw_vertices)/3)):
-        mesh_vertices.append([raw_vertices[i * 3 + 0],raw_vertices[i * 3 + 1],raw_vertices[i * 3 + 2]])
-        
-    mesh_faces = []
-    raw_faces = skeleton_data[FACES_KEY]
-    for i in range(int(len(raw_faces)/3)):
-        mesh_faces.append([raw_faces[i * 3 + 0],raw_faces[i * 3 + 1],raw_faces[i * 3 + 2]])
-        
-    sk_points = []
-    raw_sk_points = skeleton_data[SKPOINTS_KEY]
-    for i in range(int(len(raw_sk_points)/3)):
-        sk_points.append([raw_sk_points[i * 3 + 0],raw_sk_points[i * 3 + 1],raw_sk_points[i * 3 + 2]])    
-    sk_edges = []
-    raw_sk_edges = skeleton_data[SKEDGES_KEY]
-    for i in range(int(len(raw_sk_edges)/2)):
-        sk_edges.append([raw_sk_edges[i * 2 + 0],raw_sk_edges[i * 2 + 1]])    
-        
-    return mesh_vertices, mesh_faces, sk_points, sk_edges
+    skeleton = Skeleton.Load(skeleton_json_path)
+    return skeleton.vertices, skeleton.faces, skeleton.points, skeleton.edges
     
+# sk_json is the path of a skeleton data json or the Skeleton returned by LoadSkeletonData
 def WriteVesselAndCenterlineVtk(sk_json, case_name, output_path):
     
-    vertices, faces, sk_points, sk_edges = ParseDataFromJsons(sk_json)
+    skeleton = LoadSkeletonData(sk_json) if isinstance(sk_json, str) else sk_json
     
     vessel_vtk_path = os.path.join(output_path,case_name + "_Vessel.vtk")
     centerline_vtk_path = os.path.join(output_path,case_name + "_Centerline.vtk")
 
-    write_vtk_unstructured_grid(vertices, faces, vessel_vtk_path)
-    write_vtk_unstructured_grid(sk_points, sk_edges, centerline_vtk_path)
\ No newline at end of file
+    write_vtk_unstructured_grid(skeleton.vertices, skeleton.faces, vessel_vtk_path, 3)
+    write_vtk_unstructured_grid(skeleton.points, skeleton.edges, centerline_vtk_path, 2)
\ No newline at end of file
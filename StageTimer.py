@@ -0,0 +1,50 @@
+import time
+import contextlib
+
+# Wall and cpu time of the stages of a case. A case's timings are a dictionary of
+# stage name -> [wall seconds, cpu seconds], None when timing is disabled, in which case
+# Stage returns a shared no-op context so the instrumentation costs next to nothing.
+# Cpu time is the time of the calling thread, child processes are not included.
+
+_no_stage = contextlib.nullcontext()
+
+def NewTimings(enabled):
+    return {} if enabled else None
+
+@contextlib.contextmanager
+def _TimedStage(timings, name):
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    try:
+        yield
+    finally:
+        stage_times = timings.setdefault(name, [0.0, 0.0])
+        stage_times[0] += time.perf_counter() - wall_start
+        stage_times[1] += time.thread_time() - cpu_start
+
+def Stage(timings, name):
+    if timings is None:
+        return _no_stage
+    return _TimedStage(timings, name)
+
+def TotalWallTime(timings, exclude=()):
+    if not timings:
+        return 0
+    return sum(times[0] for stage, times in timings.items() if stage not in exclude)
+
+def CreateTimingsFile(timings_path):
+    with open(timings_path, "w") as timings_file:
+        timings_file.write('Case, Stage, Wall_Time, Cpu_Time\n')
+
+def WriteTimings(timings_path, case_name, timings):
+    if not timings:
+        return
+    with open(timings_path, "a") as timings_file:
+        timings_file.write("".join(case_name + "," + stage + "," + str(times[0]) + "," + str(times[1]) + "\n"
+                                   for stage, times in timings.items()))
+
+# timings flattened to time_<stage> keys for nni.report_intermediate_result
+def TimingMetrics(timings):
+    if not timings:
+        return {}
+    return {"time_" + stage: times[0] for stage, times in timings.items()}
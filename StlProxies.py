@@ -0,0 +1,163 @@
+import os
+import math
+import argparse
+import numpy as np
+import FileUtils
+import StlReader
+import CaseManifest
+
+# Decimated low fidelity proxies of the input STLs for cheap screening trials. A proxy is built by
+# vertex clustering: the welded mesh vertices are snapped to a uniform grid, every occupied cell
+# becomes one vertex at the mean of its vertices and triangles that collapse or repeat are dropped.
+# The cell size is searched until the proxy has about the target number of triangles. Proxies are
+# cached by the content hash of their source in <proxy_dir>/<target>/<hash>/<case>.stl, meshes that
+# are already smaller than the target are used as they are. Clustering may leave non manifold edges
+# on thin vessels, so proxy scores only rank parameter sets, ProxyCorrelation tells how well.
+#   python StlProxies.py build <stl_dir> <proxy_dir> --levels 2000 10000 50000
+#   python StlProxies.py correlate <experiment_dir> --case-column bifurcations
+
+PROXY_LEVELS = [2000, 10000, 50000]
+# a proxy within this fraction of its target is close enough
+TARGET_TOLERANCE = 0.1
+MAX_SEARCH_STEPS = 8
+HASH_DIR_LENGTH = 16
+
+# (vertices, faces) of a triangle soup with coincident corners merged
+def WeldVertices(triangles):
+    vertices, faces = np.unique(triangles.reshape(-1, 3), axis=0, return_inverse=True)
+    return vertices, faces.reshape(-1, 3)
+
+# (vertices, faces) with the vertices merged per cell of a grid with the given cell size
+def ClusterVertices(vertices, faces, cell_size):
+    cells = np.floor((vertices - vertices.min(axis=0)) / cell_size).astype(np.int64)
+    _, vertex_clusters = np.unique(cells, axis=0, return_inverse=True)
+    vertex_clusters = vertex_clusters.ravel()
+    counts = np.bincount(vertex_clusters)
+    clustered = np.stack([np.bincount(vertex_clusters, weights=vertices[:, axis]) for axis in range(3)], axis=1) / counts[:, None]
+
+    cluster_faces = vertex_clusters[faces]
+    keep = ((cluster_faces[:, 0] != cluster_faces[:, 1]) & (cluster_faces[:, 1] != cluster_faces[:, 2])
+            & (cluster_faces[:, 0] != cluster_faces[:, 2]))
+    cluster_faces = cluster_faces[keep]
+    if len(cluster_faces):
+        _, first_faces = np.unique(np.sort(cluster_faces, axis=1), axis=0, return_index=True)
+        cluster_faces = cluster_faces[np.sort(first_faces)]
+    return clustered.astype(np.float32), cluster_faces
+
+# (vertices, faces) of a mesh decimated to about target_triangles
+def Decimate(triangles, target_triangles):
+    vertices, faces = WeldVertices(triangles)
+    if len(faces) <= target_triangles:
+        return vertices, faces
+
+    # a surface tiled by square cells has about two triangles per cell
+    edges_a = (triangles[:, 1] - triangles[:, 0]).astype(np.float64)
+    edges_b = (triangles[:, 2] - triangles[:, 0]).astype(np.float64)
+    area = 0.5 * np.linalg.norm(np.cross(edges_a, edges_b), axis=1).sum()
+    cell_size = math.sqrt(2 * area / target_triangles)
+
+    best = None
+    for _ in range(MAX_SEARCH_STEPS):
+        proxy_vertices, proxy_faces = ClusterVertices(vertices, faces, cell_size)
+        if len(proxy_faces) and (best is None or abs(len(proxy_faces) - target_triangles) < abs(len(best[1]) - target_triangles)):
+            best = (proxy_vertices, proxy_faces)
+        if abs(len(proxy_faces) - target_triangles) <= TARGET_TOLERANCE * target_triangles:
+            break
+        cell_size *= math.sqrt(len(proxy_faces) / target_triangles) if len(proxy_faces) else 0.5
+    return best if best is not None else (vertices, faces)
+
+def WriteStl(vertices, faces, stl_path):
+    triangles = vertices[faces]
+    normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    normals /= np.maximum(np.linalg.norm(normals, axis=1), 1e-12)[:, None]
+    records = np.zeros(len(faces), dtype=StlReader.BINARY_TRIANGLE_DTYPE)
+    records['normal'] = normals
+    records['vertices'] = triangles
+
+    header = b'decimated proxy'.ljust(80, b' ') + np.uint32(len(records)).tobytes()
+    FileUtils.AtomicWrite(stl_path, lambda stl_file: stl_file.write(header + records.tobytes()), 'wb')
+
+def ProxyPath(proxy_dir, target_triangles, case_name, stl_hash):
+    return os.path.join(proxy_dir, str(target_triangles), stl_hash[:HASH_DIR_LENGTH], case_name + ".stl")
+
+# path of the proxy of a manifest case, built on first use
+def CaseProxy(proxy_dir, target_triangles, case_name, entry):
+    if entry["triangles"] <= target_triangles:
+        return entry["path"]
+    proxy_path = ProxyPath(proxy_dir, target_triangles, case_name, entry["hash"])
+    if not os.path.isfile(proxy_path):
+        os.makedirs(os.path.dirname(proxy_path), exist_ok=True)
+        WriteStl(*Decimate(StlReader.ReadTriangles(entry["path"]), target_triangles), proxy_path)
+    return proxy_path
+
+# proxy STL paths of all cases of the manifest at one level, in the order of CaseManifest.InputFiles
+def ProxyInputFiles(manifest, proxy_dir, target_triangles):
+    return [CaseProxy(proxy_dir, target_triangles, case_name, entry) for case_name, entry in manifest["cases"].items()]
+
+# pearson and spearman correlation of paired scores
+def Correlation(x_scores, y_scores):
+    x_scores = np.asarray(x_scores, dtype=np.float64)
+    y_scores = np.asarray(y_scores, dtype=np.float64)
+    stats = {"pairs": len(x_scores), "pearson": None, "spearman": None}
+    if len(x_scores) < 3 or x_scores.std() == 0 or y_scores.std() == 0:
+        return stats
+    stats["pearson"] = float(np.corrcoef(x_scores, y_scores)[0, 1])
+    x_ranks = x_scores.argsort().argsort()
+    y_ranks = y_scores.argsort().argsort()
+    stats["spearman"] = float(np.corrcoef(x_ranks, y_ranks)[0, 1])
+    return stats
+
+# passed case name -> score of a trial report
+def ReadPassedCaseScores(trial_report_path, case_column):
+    return {row["Case"]: float(row[case_column]) for row in FileUtils.ReadCsvRows(trial_report_path)
+            if int(row["passed"]) and case_column in row}
+
+# how well the scores of proxy trials track the full resolution trials with the same parameters:
+# level -> {"trials": correlation of the default scores, "cases": correlation of the case scores}
+def ProxyCorrelation(experiment_dir, case_column=None):
+    trials_by_level = {}
+    for row in FileUtils.ReadCsvRows(os.path.join(experiment_dir, "Main_Report.csv")):
+        if row.get("Status") in ("complete", "proxy") and int(row.get("Cases_Ran", 0)) > 0:
+            level = int(float(row.get("Fidelity", 0)))
+            trials_by_level.setdefault(level, {})[(row["QST"], row["MST"], row["MinEL"])] = row
+
+    full_trials = trials_by_level.get(0, {})
+    correlations = {}
+    for level, proxy_trials in sorted(trials_by_level.items()):
+        if level == 0:
+            continue
+        shared_params = [params for params in proxy_trials if params in full_trials]
+        correlations[level] = {"trials": Correlation([float(proxy_trials[params]["default"]) for params in shared_params],
+                                                     [float(full_trials[params]["default"]) for params in shared_params])}
+        if case_column:
+            proxy_scores = []
+            full_scores = []
+            for params in shared_params:
+                proxy_cases = ReadPassedCaseScores(os.path.join(experiment_dir, proxy_trials[params]["Trial_Id"], "Trial_Report.csv"), case_column)
+                full_cases = ReadPassedCaseScores(os.path.join(experiment_dir, full_trials[params]["Trial_Id"], "Trial_Report.csv"), case_column)
+                for case_name in proxy_cases.keys() & full_cases.keys():
+                    proxy_scores.append(proxy_cases[case_name])
+                    full_scores.append(full_cases[case_name])
+            correlations[level]["cases"] = Correlation(proxy_scores, full_scores)
+    return correlations
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build decimated STL proxies or compare proxy and full resolution scores")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build")
+    build_parser.add_argument("stl_dir")
+    build_parser.add_argument("proxy_dir")
+    build_parser.add_argument("--levels", type=int, nargs="+", default=PROXY_LEVELS, help="target triangle counts")
+    correlate_parser = subparsers.add_parser("correlate")
+    correlate_parser.add_argument("experiment_dir")
+    correlate_parser.add_argument("--case-column", help="trial report column to also correlate per case")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        manifest = CaseManifest.BuildManifest(args.stl_dir)
+        for level in args.levels:
+            ProxyInputFiles(manifest, args.proxy_dir, level)
+            print("Built " + str(len(manifest["cases"])) + " proxies at " + str(level) + " triangles")
+    else:
+        for level, stats in ProxyCorrelation(args.experiment_dir, args.case_column).items():
+            print(str(level) + " triangles: " + ", ".join(name + " " + str(level_stats) for name, level_stats in stats.items()))
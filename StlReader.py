@@ -0,0 +1,65 @@
+import os
+import re
+import sys
+import numpy as np
+
+# NumPy STL reader for the pre-analysis of the cases: binary STLs are viewed straight from the file
+# bytes through a record dtype, ascii STLs are parsed with one regular expression over the vertex
+# lines. A binary STL is recognized by its size matching the triangle count in its header, ascii
+# files may also start with "solid" so the header text alone does not tell them apart.
+#   python StlReader.py <stl> [<stl> ...]
+
+BINARY_HEADER_SIZE = 84
+BINARY_TRIANGLE_DTYPE = np.dtype([('normal', '<f4', (3,)), ('vertices', '<f4', (3, 3)), ('attribute', '<u2')])
+ASCII_VERTEX_PATTERN = re.compile(rb'vertex\s+(\S+)\s+(\S+)\s+(\S+)')
+
+# triangle count from the binary header, None for an ascii STL
+def BinaryTriangleCount(stl_path):
+    with open(stl_path, 'rb') as stl_file:
+        header = stl_file.read(BINARY_HEADER_SIZE)
+    if len(header) < BINARY_HEADER_SIZE:
+        return None
+    triangle_cnt = int(np.frombuffer(header[80:84], dtype='<u4')[0])
+    if BINARY_HEADER_SIZE + BINARY_TRIANGLE_DTYPE.itemsize * triangle_cnt != os.path.getsize(stl_path):
+        return None
+    return triangle_cnt
+
+# triangle count without reading the triangles of a binary STL
+def TriangleCount(stl_path):
+    triangle_cnt = BinaryTriangleCount(stl_path)
+    if triangle_cnt is not None:
+        return triangle_cnt
+    with open(stl_path, 'rb') as stl_file:
+        return sum(line.lstrip().startswith(b'facet') for line in stl_file)
+
+# (triangle count, 3, 3) float32 corners of the triangles
+def ReadTriangles(stl_path):
+    triangle_cnt = BinaryTriangleCount(stl_path)
+    if triangle_cnt is not None:
+        records = np.fromfile(stl_path, dtype=BINARY_TRIANGLE_DTYPE, count=triangle_cnt, offset=BINARY_HEADER_SIZE)
+        return records['vertices']
+
+    with open(stl_path, 'rb') as stl_file:
+        coordinates = ASCII_VERTEX_PATTERN.findall(stl_file.read())
+    return np.array(coordinates, dtype=np.float32).reshape(-1, 3, 3)
+
+# triangle count, bounding box and surface area of an STL
+def StlStats(stl_path):
+    triangles = ReadTriangles(stl_path)
+    if not len(triangles):
+        return {"triangles": 0, "bbox_min": [0.0] * 3, "bbox_max": [0.0] * 3, "area": 0.0}
+
+    corners = triangles.reshape(-1, 3)
+    edges_a = (triangles[:, 1] - triangles[:, 0]).astype(np.float64)
+    edges_b = (triangles[:, 2] - triangles[:, 0]).astype(np.float64)
+    area = 0.5 * np.linalg.norm(np.cross(edges_a, edges_b), axis=1).sum()
+    return {
+        "triangles": len(triangles),
+        "bbox_min": corners.min(axis=0).astype(float).tolist(),
+        "bbox_max": corners.max(axis=0).astype(float).tolist(),
+        "area": float(area),
+    }
+
+if __name__ == '__main__':
+    for stl_path in sys.argv[1:]:
+        print(stl_path + ": " + str(StlStats(stl_path)))
@@ -0,0 +1,61 @@
+import os
+import hashlib
+import numpy as np
+import FileUtils
+
+# Asynchronous successive halving over the case set. A trial's budget is the number of cases it runs:
+# every trial starts on the first rung (a small fixed subset of the cases), records its score for the
+# rung in Rung_Report.csv and only continues to the next, larger rung while it is in the best 1/eta
+# of the trials that reached the same rung.
+
+FAILED_SCORE = 1e+10
+
+# fixed case order shared by all trials, hashed so the first rungs are not just the first names
+def OrderCases(input_files):
+    return sorted(input_files, key=lambda path: hashlib.sha1(os.path.basename(path).lower().encode()).hexdigest())
+
+# number of cases run after each rung, 0 in rungs means all cases
+def RungSizes(rungs, case_count):
+    sizes = sorted(set(min(rung or case_count, case_count) for rung in rungs) | {case_count})
+    return [size for size in sizes if size > 0]
+
+# mean score of the passed cases so far
+def RungScore(trial_data, score_key):
+    scores = [data[score_key] for data in trial_data.values() if data["passed"]]
+    if not scores:
+        return FAILED_SCORE
+    return sum(scores) / len(scores)
+
+def ReadRungScores(rung_report_path, rung):
+    scores = {}
+    if os.path.isfile(rung_report_path):
+        with open(rung_report_path) as report_file:
+            next(report_file, None)
+            for line in report_file:
+                values = [value.strip() for value in line.split(',')]
+                if len(values) == 4 and values[1] == str(rung):
+                    scores[values[0]] = float(values[3])
+    return scores
+
+# record the trial score at a rung and return True if the trial should continue to the next rung
+def Promote(rung_report_path, trial_id, rung, case_cnt, score, eta, min_trials, optimize_mode="minimize"):
+    # concurrent trials append to the same report, the row is written and the rung read under its lock
+    with FileUtils.FileLock(rung_report_path):
+        if not os.path.isfile(rung_report_path):
+            with open(rung_report_path, "a") as report_file:
+                report_file.write('Trial_Id, Rung, Cases, Score\n')
+        with open(rung_report_path, "a") as report_file:
+            report_file.write(str(trial_id) + "," + str(rung) + "," + str(case_cnt) + "," + str(score) + "\n")
+        rung_scores = ReadRungScores(rung_report_path, rung)
+
+    rung_scores[str(trial_id)] = score
+    # too few trials reached this rung to rank against, keep going
+    if len(rung_scores) < min_trials:
+        return True
+
+    scores = np.array(list(rung_scores.values()))
+    if optimize_mode == "maximize":
+        better_cnt = (scores > score).sum()
+    else:
+        better_cnt = (scores < score).sum()
+    return better_cnt < max(1, len(scores) // eta)
@@ -0,0 +1,168 @@
+import os
+import json
+import zlib
+import argparse
+import numpy as np
+import SKJson2VTk
+
+# Synthetic SkeletonData jsons for benchmarking without SK_Lite or patient data. The skeleton is a
+# binary vessel tree of equally long polylines that branch at their ends, the surface mesh is a tube
+# of rings around every polyline that narrows towards the leaves. Sizes are given in surface mesh
+# vertices, from hundreds up to millions.
+#   python SyntheticSkeleton.py <output_dir> --vertices 1000 100000 1000000
+#   python SyntheticSkeleton.py <stl_dir> --stl --vertices 20000
+
+SEGMENT_POINTS = 16
+RING_SIZE = 8
+STEP_LENGTH = 1.0
+STEP_JITTER = 0.15
+BRANCH_SPREAD = 0.6
+ROOT_RADIUS = 4.0
+RADIUS_DECAY = 0.8
+REFERENCE_NOISE = 0.3
+
+# stable seed from a case name, so a mock run regenerates the tree of the case's STL
+def CaseSeed(case_name):
+    return zlib.crc32(case_name.lower().encode())
+
+# points (N x 3), radii (N) and polylines (count x segment_points + 1) of a binary tree in heap
+# order: the parent of polyline i is (i - 1) // 2 and every polyline starts at its parent's last point
+def GenerateTree(polyline_count, segment_points=SEGMENT_POINTS, seed=0):
+    rng = np.random.default_rng(seed)
+    points = np.zeros((1 + polyline_count * segment_points, 3))
+    radii = np.full(len(points), ROOT_RADIUS)
+    polylines = np.empty((polyline_count, segment_points + 1), dtype=np.int64)
+    directions = np.empty((polyline_count, 3))
+    taper = RADIUS_DECAY ** (np.arange(1, segment_points + 1) / segment_points)
+
+    # one tree level at a time, each level depends only on the one above it
+    level_start, level_size = 0, 1
+    while level_start < polyline_count:
+        indices = np.arange(level_start, min(level_start + level_size, polyline_count))
+        if level_start == 0:
+            start_ids = np.zeros(1, dtype=np.int64)
+            parent_directions = np.array([[1.0, 0.0, 0.0]])
+        else:
+            parents = (indices - 1) // 2
+            start_ids = polylines[parents, -1]
+            parent_directions = directions[parents]
+
+        level_directions = parent_directions + rng.normal(scale=BRANCH_SPREAD, size=(len(indices), 3))
+        level_directions /= np.linalg.norm(level_directions, axis=1)[:, None]
+        directions[indices] = level_directions
+
+        steps = level_directions[:, None, :] * STEP_LENGTH + rng.normal(scale=STEP_JITTER, size=(len(indices), segment_points, 3))
+        point_ids = 1 + indices[:, None] * segment_points + np.arange(segment_points)
+        points[point_ids] = points[start_ids][:, None, :] + np.cumsum(steps, axis=1)
+        radii[point_ids] = radii[start_ids][:, None] * taper
+        polylines[indices, 0] = start_ids
+        polylines[indices, 1:] = point_ids
+
+        level_start += level_size
+        level_size *= 2
+    return points, radii, polylines
+
+def PolylineEdges(polylines):
+    return np.stack([polylines[:, :-1], polylines[:, 1:]], axis=-1).reshape(-1, 2)
+
+# vertices (M x 3) and triangles (F x 3) of a tube of rings around every polyline
+def TubeMesh(points, radii, polylines, ring_size=RING_SIZE):
+    centers = points[polylines]
+    tangents = np.gradient(centers, axis=1)
+    tangents /= np.linalg.norm(tangents, axis=2)[..., None]
+    helper = np.where(np.abs(tangents[..., 2:3]) > 0.9, [1.0, 0.0, 0.0], [0.0, 0.0, 1.0])
+    u = np.cross(tangents, helper)
+    u /= np.linalg.norm(u, axis=2)[..., None]
+    v = np.cross(tangents, u)
+
+    angles = 2 * np.pi * np.arange(ring_size) / ring_size
+    offsets = np.cos(angles)[None, None, :, None] * u[:, :, None, :] + np.sin(angles)[None, None, :, None] * v[:, :, None, :]
+    vertices = centers[:, :, None, :] + radii[polylines][:, :, None, None] * offsets
+
+    # two triangles per quad between consecutive rings
+    vertex_ids = np.arange(vertices.shape[0] * vertices.shape[1] * ring_size).reshape(vertices.shape[:3])
+    ring, next_ring = vertex_ids[:, :-1, :], vertex_ids[:, 1:, :]
+    ring_shifted, next_ring_shifted = np.roll(ring, -1, axis=2), np.roll(next_ring, -1, axis=2)
+    faces = np.concatenate([np.stack([ring, next_ring, next_ring_shifted], axis=-1).reshape(-1, 3),
+                            np.stack([ring, next_ring_shifted, ring_shifted], axis=-1).reshape(-1, 3)])
+    return vertices.reshape(-1, 3), faces
+
+# decoded skeleton data (numpy arrays, nested polylines) with about vertex_count surface mesh vertices
+def GenerateSkeletonData(vertex_count, segment_points=SEGMENT_POINTS, ring_size=RING_SIZE, seed=0):
+    polyline_count = max(1, int(round(vertex_count / ((segment_points + 1) * ring_size))))
+    points, radii, polylines = GenerateTree(polyline_count, segment_points, seed)
+    vertices, faces = TubeMesh(points, radii, polylines, ring_size)
+    return {
+        SKJson2VTk.VERTICES_KEY: vertices,
+        SKJson2VTk.FACES_KEY: faces,
+        SKJson2VTk.MATRIX_KEY: np.eye(4),
+        SKJson2VTk.SKPOINTS_KEY: points,
+        SKJson2VTk.SKEDGES_KEY: PolylineEdges(polylines),
+        SKJson2VTk.POLYLINES_KEY: polylines,
+    }
+
+# the skeleton points moved by some noise, a stand in for a reference centerline
+def ReferencePoints(points, noise=REFERENCE_NOISE, seed=1):
+    return points + np.random.default_rng(seed).normal(scale=noise, size=points.shape)
+
+# write skeleton data in the SK_Lite layout: flat arrays and nested polylines
+def WriteSkeletonJson(skeleton_data, json_path):
+    json_data = {key: np.asarray(values).ravel().tolist() for key, values in skeleton_data.items()
+                 if key != SKJson2VTk.POLYLINES_KEY}
+    json_data[SKJson2VTk.POLYLINES_KEY] = np.asarray(skeleton_data[SKJson2VTk.POLYLINES_KEY]).tolist()
+    if SKJson2VTk.orjson is not None:
+        with open(json_path, 'wb') as json_file:
+            json_file.write(SKJson2VTk.orjson.dumps(json_data))
+    else:
+        with open(json_path, 'w') as json_file:
+            json.dump(json_data, json_file)
+
+# write <name>_SkeletonData.json and a matching reference <name>_Centerline.vtk, returns both paths
+def WriteSyntheticCase(output_dir, case_name, vertex_count, seed=0):
+    skeleton_data = GenerateSkeletonData(vertex_count, seed=seed)
+    json_path = os.path.join(output_dir, case_name + "_SkeletonData.json")
+    reference_path = os.path.join(output_dir, case_name + "_Centerline.vtk")
+    WriteSkeletonJson(skeleton_data, json_path)
+    SKJson2VTk.write_vtk_unstructured_grid(ReferencePoints(skeleton_data[SKJson2VTk.SKPOINTS_KEY], seed=seed + 1),
+                                           skeleton_data[SKJson2VTk.SKEDGES_KEY], reference_path, 2)
+    return json_path, reference_path
+
+# binary STL of a triangle mesh
+def WriteStl(vertices, faces, stl_path):
+    triangles = np.asarray(vertices)[np.asarray(faces)]
+    normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    normals /= np.maximum(np.linalg.norm(normals, axis=1), 1e-12)[:, None]
+    records = np.zeros(len(triangles), dtype=[('normal', '<f4', (3,)), ('vertices', '<f4', (3, 3)), ('attribute', '<u2')])
+    records['normal'] = normals
+    records['vertices'] = triangles
+    with open(stl_path, 'wb') as stl_file:
+        stl_file.write(b'synthetic vessel'.ljust(80, b' '))
+        stl_file.write(np.uint32(len(records)).tobytes())
+        stl_file.write(records.tobytes())
+
+# write <name>.stl, the tube surface of a synthetic tree, and optionally its reference centerline
+# <name>.vtk into reference_dir, returns the stl path
+def WriteSyntheticStl(output_dir, case_name, vertex_count, reference_dir=None):
+    skeleton_data = GenerateSkeletonData(vertex_count, seed=CaseSeed(case_name))
+    stl_path = os.path.join(output_dir, case_name + ".stl")
+    WriteStl(skeleton_data[SKJson2VTk.VERTICES_KEY], skeleton_data[SKJson2VTk.FACES_KEY], stl_path)
+    if reference_dir is not None:
+        SKJson2VTk.write_vtk_unstructured_grid(ReferencePoints(skeleton_data[SKJson2VTk.SKPOINTS_KEY]),
+                                               skeleton_data[SKJson2VTk.SKEDGES_KEY], os.path.join(reference_dir, case_name + ".vtk"), 2)
+    return stl_path
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write synthetic skeleton data jsons and reference centerlines")
+    parser.add_argument("output_dir")
+    parser.add_argument("--vertices", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stl", action="store_true", help="write surface STLs (skeletonization inputs) instead of jsons")
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    for vertex_count in args.vertices:
+        if args.stl:
+            output_path = WriteSyntheticStl(args.output_dir, "Synthetic_" + str(vertex_count), vertex_count)
+        else:
+            output_path, _ = WriteSyntheticCase(args.output_dir, "Synthetic_" + str(vertex_count), vertex_count, args.seed)
+        print("Wrote " + output_path)
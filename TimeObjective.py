@@ -0,0 +1,55 @@
+import FileUtils
+
+# Time aware objectives: the quality score of a trial (its average case score) combined with the
+# average skeletonization time of its passed cases, so the tuner does not settle on parameters that
+# are much slower for a marginal gain.
+#   quality   the quality score only
+#   weighted  quality + time_weight * seconds (minus when maximizing)
+#   budget    quality, plus budget_penalty for every 100% the average time is over the time budget
+#   pareto    the quality score, and the trials that are not dominated in quality and time are
+#             tracked in Pareto_Front.csv to choose the shipped parameters from
+
+OBJECTIVE_MODES = ("quality", "weighted", "budget", "pareto")
+PARETO_FRONT_FILE = "Pareto_Front.csv"
+
+# average skeletonization time of the passed cases
+def AverageTime(trial_data):
+    times = [data["total_time"] for data in trial_data.values() if data["passed"]]
+    return sum(times) / len(times) if times else 0
+
+def Objective(quality, avg_time, mode, optimize_mode="minimize", time_weight=0, time_budget=0, budget_penalty=0):
+    if mode not in OBJECTIVE_MODES:
+        raise ValueError("Unknown objective mode " + str(mode))
+    # time always makes the objective worse
+    sign = -1 if optimize_mode == "maximize" else 1
+    if mode == "weighted":
+        return quality + sign * time_weight * avg_time
+    if mode == "budget" and time_budget > 0:
+        return quality + sign * budget_penalty * max(0, avg_time / time_budget - 1)
+    return quality
+
+# trials of (trial_id, quality, avg_time) that no other trial beats in both quality and time
+def ParetoFront(trials, optimize_mode="minimize"):
+    sign = -1 if optimize_mode == "maximize" else 1
+    front = []
+    best_quality = None
+    # by time, then quality: a trial is on the front if it is better than every faster trial
+    for trial_id, quality, avg_time in sorted(trials, key=lambda trial: (trial[2], sign * trial[1])):
+        if best_quality is None or sign * quality < sign * best_quality:
+            front.append((trial_id, quality, avg_time))
+            best_quality = quality
+    return front
+
+# recompute the front of the complete trials of a main report into front_path, returns the front
+def UpdateParetoFront(main_report_path, front_path, optimize_mode="minimize"):
+    trials = [(row["Trial_Id"], float(row["Quality"]), float(row["Avg_Time"])) for row in FileUtils.ReadCsvRows(main_report_path)
+              if row.get("Status") == "complete" and int(row.get("Cases_Ran", 0)) > 0 and "Quality" in row]
+    front = ParetoFront(trials, optimize_mode)
+
+    FileUtils.AtomicWrite(front_path, lambda front_file: WriteFront(front_file, front))
+    return front
+
+def WriteFront(front_file, front):
+    front_file.write('Trial_Id, Quality, Avg_Time\n')
+    for trial_id, quality, avg_time in front:
+        front_file.write(trial_id + "," + str(quality) + "," + str(avg_time) + "\n")
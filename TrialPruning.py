@@ -0,0 +1,89 @@
+import os
+import numpy as np
+
+# Median / percentile stopping rule for a running trial. After every case the running mean of the
+# trial's case scores is compared with the running means of completed trials at the same case index,
+# a trial that is worse than the given percentile of them is stopped. Only trials that ran all their
+# cases count as history, and a trial whose cases all failed so far is worse than any of them.
+
+# statuses of the trials that ran all cases, at full resolution or on proxies
+COMPLETE_STATUSES = ("complete", "proxy")
+
+# returns the trial ids listed in a main report, only those that ran at the given proxy fidelity
+# (0 = full resolution) when the report has a Fidelity column and, unless statuses is None, only
+# those with one of the statuses when it has a Status column
+def ReadCompletedTrials(main_report_path, fidelity=0, statuses=COMPLETE_STATUSES):
+    trial_ids = []
+    if os.path.isfile(main_report_path):
+        with open(main_report_path) as report_file:
+            header = [column.strip() for column in next(report_file, '').split(',')]
+            fidelity_index = header.index('Fidelity') if 'Fidelity' in header else None
+            status_index = header.index('Status') if 'Status' in header and statuses is not None else None
+            for line in report_file:
+                values = line.rstrip('\n').split(',')
+                trial_id = values[0].strip()
+                if fidelity_index is not None and len(values) > fidelity_index and int(float(values[fidelity_index])) != fidelity:
+                    continue
+                if status_index is not None and len(values) > status_index and values[status_index].strip() not in statuses:
+                    continue
+                if trial_id:
+                    trial_ids.append(trial_id)
+    return trial_ids
+
+# returns the case scores of a trial report in case order, None for failed cases
+def ReadCaseScores(trial_report_path, score_column):
+    scores = []
+    with open(trial_report_path) as report_file:
+        header = [column.strip() for column in next(report_file, '').split(',')]
+        if score_column not in header:
+            return scores
+        score_index = header.index(score_column)
+        passed_index = header.index('passed')
+        for line in report_file:
+            values = line.rstrip('\n').split(',')
+            if len(values) != len(header):
+                continue
+            scores.append(float(values[score_index]) if int(values[passed_index]) else None)
+    return scores
+
+# running mean of the passed case scores after each case, None until a case passed
+def RunningMeans(case_scores):
+    running_means = []
+    score_sum = 0
+    passed_cnt = 0
+    for score in case_scores:
+        if score is not None:
+            score_sum += score
+            passed_cnt += 1
+        running_means.append(score_sum / passed_cnt if passed_cnt else None)
+    return running_means
+
+# running means of every completed trial of the experiment at a fidelity except exclude_trial_id
+def LoadHistory(experiment_dir, main_report_path, score_column, exclude_trial_id=None, fidelity=0):
+    history = []
+    for trial_id in ReadCompletedTrials(main_report_path, fidelity):
+        trial_report_path = os.path.join(experiment_dir, trial_id, "Trial_Report.csv")
+        if trial_id == exclude_trial_id or not os.path.isfile(trial_report_path):
+            continue
+        history.append(RunningMeans(ReadCaseScores(trial_report_path, score_column)))
+    return history
+
+# True if the trial with the given case scores so far should be stopped
+def ShouldStop(case_scores, history, percentile, min_trials, min_cases, optimize_mode="minimize"):
+    case_index = len(case_scores) - 1
+    if len(case_scores) < min_cases:
+        return False
+
+    history_means = [means[case_index] for means in history
+                     if len(means) > case_index and means[case_index] is not None]
+    if len(history_means) < min_trials:
+        return False
+
+    # no case passed yet, worse than every trial that had a passed case by now
+    running_mean = RunningMeans(case_scores)[-1]
+    if running_mean is None:
+        return True
+
+    if optimize_mode == "maximize":
+        return running_mean < np.percentile(history_means, 100 - percentile)
+    return running_mean > np.percentile(history_means, percentile)
@@ -0,0 +1,189 @@
+import os
+import sys
+import time
+import zipfile
+import argparse
+import subprocess
+import FileUtils
+
+# Retention of the per trial artifacts (input/, output/<case>/ and vtks/). After a trial finishes the
+# RETENTION_TOP_K best complete trials keep all their files and every trial keeps the files of its
+# failed cases. The rest is compressed into <trial>/Artifacts.zip or pruned, the csv reports always
+# stay. A trial that moves into the top k later gets its archive extracted again. While the trial
+# directories are over the size budget the archives of the worst trials are deleted.
+# Concurrent trials are safe: one pass runs at a time per experiment (Retention.lock, a pass that
+# finds it taken is skipped, the next trial runs it again) and trials that are not in Main_Report.csv
+# yet are still running and never touched.
+#   python TrialRetention.py <experiment_dir> --top-k 10 --mode compress --max-gb 50
+
+ARTIFACT_DIRS = ("input", "output", "vtks")
+ARCHIVE_NAME = "Artifacts.zip"
+LOCK_FILE = "Retention.lock"
+LOG_FILE = "Retention_Log.txt"
+# a lock older than this was left by a pass that died
+LOCK_STALE_SECONDS = 3600
+# a trial without a main report row and untouched this long was killed, not running
+RUNNING_TRIAL_MAX_AGE = 2 * 24 * 3600
+
+def AcquireLock(lock_path):
+    try:
+        if time.time() - os.path.getmtime(lock_path) > LOCK_STALE_SECONDS:
+            os.remove(lock_path)
+    except OSError:
+        pass
+    try:
+        lock_fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    os.write(lock_fd, str(os.getpid()).encode())
+    os.close(lock_fd)
+    return True
+
+def ReleaseLock(lock_path):
+    try:
+        os.remove(lock_path)
+    except OSError:
+        pass
+
+# reported trial ids, best first: complete trials by score, then the partial and proxy ones
+def RankTrials(main_report_path, optimize_mode="minimize"):
+    rows = FileUtils.ReadCsvRows(main_report_path)
+    complete = [row for row in rows if row.get("Status", "complete") == "complete" and int(row.get("Cases_Ran", 0)) > 0]
+    complete.sort(key=lambda row: float(row["default"]), reverse=(optimize_mode == "maximize"))
+    return list(dict.fromkeys([row["Trial_Id"] for row in complete] + [row["Trial_Id"] for row in rows]))
+
+# artifact paths of the failed cases of a trial, relative to the trial directory
+def FailedCasePaths(trial_dir):
+    paths = set()
+    for row in FileUtils.ReadCsvRows(os.path.join(trial_dir, "Trial_Report.csv")):
+        if not int(row["passed"]):
+            paths.add(os.path.join("output", row["Case"]))
+            paths.add(os.path.join("input", row["Case"] + ".txt"))
+    return paths
+
+# artifact files of a trial relative to its directory, without the failed cases
+def ArtifactFiles(trial_dir, keep_paths):
+    files = []
+    for artifact_dir in ARTIFACT_DIRS:
+        for root, dirs, names in os.walk(os.path.join(trial_dir, artifact_dir)):
+            relative_root = os.path.relpath(root, trial_dir)
+            dirs[:] = [name for name in dirs if os.path.join(relative_root, name) not in keep_paths]
+            files += [os.path.join(relative_root, name) for name in names if os.path.join(relative_root, name) not in keep_paths]
+    return sorted(files)
+
+def RemoveFiles(trial_dir, relative_paths):
+    for relative_path in relative_paths:
+        os.remove(os.path.join(trial_dir, relative_path))
+    # drop the directories that became empty, the artifact dirs themselves stay
+    for artifact_dir in ARTIFACT_DIRS:
+        for root, dirs, names in os.walk(os.path.join(trial_dir, artifact_dir), topdown=False):
+            if root != os.path.join(trial_dir, artifact_dir) and not os.listdir(root):
+                os.rmdir(root)
+
+# compress or delete the artifacts of a trial except those of its failed cases, returns the file count
+def ReduceTrial(trial_dir, mode):
+    files = ArtifactFiles(trial_dir, FailedCasePaths(trial_dir))
+    if not files:
+        return 0
+    if mode == "compress":
+        archive_path = os.path.join(trial_dir, ARCHIVE_NAME)
+        # an archive is only complete once it is renamed, files are removed after that
+        FileUtils.AtomicWritePath(archive_path, lambda tmp_path: WriteArchive(tmp_path, archive_path, trial_dir, files))
+    RemoveFiles(trial_dir, files)
+    return len(files)
+
+# zip the files of a trial into archive_path with the members of the previous archive they do not replace
+def WriteArchive(archive_path, previous_archive_path, trial_dir, files):
+    with zipfile.ZipFile(archive_path, "w", zipfile.ZIP_DEFLATED) as archive:
+        if os.path.isfile(previous_archive_path):
+            with zipfile.ZipFile(previous_archive_path) as previous_archive:
+                archived_names = set(relative_path.replace(os.sep, "/") for relative_path in files)
+                for info in previous_archive.infolist():
+                    if info.filename not in archived_names:
+                        archive.writestr(info, previous_archive.read(info))
+        for relative_path in files:
+            archive.write(os.path.join(trial_dir, relative_path), relative_path)
+
+# extract the archive of a trial that is in the top k again
+def RestoreTrial(trial_dir):
+    archive_path = os.path.join(trial_dir, ARCHIVE_NAME)
+    if not os.path.isfile(archive_path):
+        return False
+    with zipfile.ZipFile(archive_path) as archive:
+        archive.extractall(trial_dir)
+    os.remove(archive_path)
+    return True
+
+# trial id -> directory of the finished trials, running trials are left out
+def FinishedTrialDirs(experiment_dir, reported_trials):
+    trial_dirs = {}
+    for name in os.listdir(experiment_dir):
+        trial_dir = os.path.join(experiment_dir, name)
+        trial_report_path = os.path.join(trial_dir, "Trial_Report.csv")
+        if not os.path.isfile(trial_report_path):
+            continue
+        if name in reported_trials or time.time() - os.path.getmtime(trial_report_path) > RUNNING_TRIAL_MAX_AGE:
+            trial_dirs[name] = trial_dir
+    return trial_dirs
+
+# one retention pass over an experiment, returns False when another pass holds the lock
+def ApplyRetention(experiment_dir, top_k, mode="compress", max_bytes=0, optimize_mode="minimize"):
+    lock_path = os.path.join(experiment_dir, LOCK_FILE)
+    if not AcquireLock(lock_path):
+        return False
+    try:
+        ranked = RankTrials(os.path.join(experiment_dir, "Main_Report.csv"), optimize_mode)
+        trial_dirs = FinishedTrialDirs(experiment_dir, set(ranked))
+        top_trials = set(ranked[:top_k])
+        for trial_id, trial_dir in sorted(trial_dirs.items()):
+            if trial_id in top_trials:
+                if RestoreTrial(trial_dir):
+                    print("Restored the artifacts of " + trial_id)
+            else:
+                reduced_cnt = ReduceTrial(trial_dir, mode)
+                if reduced_cnt:
+                    print(("Compressed " if mode == "compress" else "Pruned ") + str(reduced_cnt) + " files of " + trial_id)
+
+        if max_bytes:
+            EnforceBudget(trial_dirs, ranked, top_trials, max_bytes)
+    finally:
+        ReleaseLock(lock_path)
+    return True
+
+# delete archives, worst trial first, until the trial directories fit into max_bytes
+def EnforceBudget(trial_dirs, ranked, top_trials, max_bytes):
+    total_bytes = sum(FileUtils.DirSize(trial_dir) for trial_dir in trial_dirs.values())
+    rank = {trial_id: index for index, trial_id in enumerate(ranked)}
+    worst_first = sorted(trial_dirs, key=lambda trial_id: -rank.get(trial_id, len(ranked)))
+    for trial_id in worst_first:
+        if total_bytes <= max_bytes:
+            break
+        archive_path = os.path.join(trial_dirs[trial_id], ARCHIVE_NAME)
+        if trial_id not in top_trials and os.path.isfile(archive_path):
+            total_bytes -= os.path.getsize(archive_path)
+            os.remove(archive_path)
+            print("Deleted the archive of " + trial_id + " to stay in the size budget")
+    if total_bytes > max_bytes:
+        print("Trial artifacts still use " + str(total_bytes) + " bytes, over the budget of " + str(max_bytes))
+
+# run a retention pass in a detached process so the trial can exit, its output goes to Retention_Log.txt
+def StartRetention(experiment_dir, top_k, mode="compress", max_bytes=0, optimize_mode="minimize"):
+    command = [sys.executable, os.path.abspath(__file__), experiment_dir, "--top-k", str(top_k), "--mode", mode,
+               "--max-bytes", str(int(max_bytes)), "--optimize-mode", optimize_mode]
+    detach = {"creationflags": subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP} if os.name == 'nt' else {"start_new_session": True}
+    with open(os.path.join(experiment_dir, LOG_FILE), "a") as log_file:
+        return subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=log_file, stderr=subprocess.STDOUT, **detach)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compress or prune the artifacts of all but the best trials of an experiment")
+    parser.add_argument("experiment_dir")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--mode", default="compress", choices=["compress", "prune"])
+    parser.add_argument("--max-bytes", type=int, default=0, help="size budget of the trial directories, 0 = none")
+    parser.add_argument("--max-gb", type=float, default=0, help="size budget in GiB, instead of --max-bytes")
+    parser.add_argument("--optimize-mode", default="minimize", choices=["minimize", "maximize"])
+    args = parser.parse_args()
+
+    max_bytes = int(args.max_gb * 1024**3) if args.max_gb else args.max_bytes
+    if not ApplyRetention(args.experiment_dir, args.top_k, args.mode, max_bytes, args.optimize_mode):
+        print("Another retention pass is running on " + args.experiment_dir)
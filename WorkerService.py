@@ -0,0 +1,389 @@
+import os
+import sys
+import stat
+import secrets
+import argparse
+import threading
+import importlib.util
+import traceback
+import collections
+import concurrent.futures
+import multiprocessing.connection
+import ReferenceCache
+import ReferenceStore
+
+# Long lived local worker service shared by the concurrent trials of an experiment. It owns one job
+# queue and a fixed pool of workers, so cores are scheduled across trials instead of every trial
+# sizing its own pool, and it keeps the main modules, reference centerlines and their KD-trees warm
+# between trials. Trials connect over a unix socket (a path, a named pipe on windows) or local tcp
+# (host:port) and submit their cases with ServiceExecutor, the queue serves the trials round robin.
+# Jobs can only run run_case of the main modules next to this file, as they are on disk: a changed
+# module is reloaded once no job is running. A trial sends the settings run_case depends on (the
+# CASE_SETTINGS of its main module) with its jobs and they run in a copy of the module with those
+# settings, except SKELETONIZE_EXE which has to be the one of the service. Trial directories given
+# as relative paths resolve against the working directory of the service, so start it in the
+# directory the trials run in. The service tells a trial when it starts a job and which jobs it
+# dropped on a cancel, so a trial only stops waiting for jobs that will not write into it anymore.
+# The cancel event of a trial's cases is replaced by one of the service that is set when the trial
+# stops its cases or goes away, which kills the skeletonizations still running for it.
+# Messages are pickled, so the service and the trials share a secret key from WORKER_SERVICE_AUTHKEY
+# or from the file named by WORKER_SERVICE_AUTHKEY_FILE, which only its owner may read. There is no
+# default key, without one the service does not start and trials run their cases locally.
+#   python WorkerService.py --write-key ~/.nni_skeleton.key
+#   WORKER_SERVICE_AUTHKEY_FILE=~/.nni_skeleton.key python WorkerService.py /tmp/nni_skeleton.sock --workers 8
+#   WORKER_SERVICE_AUTHKEY_FILE=~/.nni_skeleton.key WORKER_SERVICE_ADDRESS=/tmp/nni_skeleton.sock nnictl create --config config.yml
+
+AUTHKEY_ENV = "WORKER_SERVICE_AUTHKEY"
+AUTHKEY_FILE_ENV = "WORKER_SERVICE_AUTHKEY_FILE"
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+# the only modules and functions jobs may run
+SERVICE_MODULES = ("RunSkeletonsMain", "RunSkeletonsMain_PCL")
+SERVICE_FUNCTIONS = ("run_case",)
+# settings a trial can not change, the service runs its own executable
+SERVICE_FIXED_SETTINGS = ("SKELETONIZE_EXE",)
+# stands in for the trial's cancel event in the jobs sent to the service
+CANCEL_EVENT = "<cancel_event>"
+
+# the shared key from the environment or the key file, ValueError when there is none or the key file
+# can be read by other users
+def ReadAuthKey():
+    if os.environ.get(AUTHKEY_ENV):
+        return os.environ[AUTHKEY_ENV].encode()
+    key_path = os.environ.get(AUTHKEY_FILE_ENV)
+    if not key_path:
+        raise ValueError("no worker service key, set " + AUTHKEY_ENV + " or " + AUTHKEY_FILE_ENV)
+    key_path = os.path.expanduser(key_path)
+    if os.name != 'nt' and stat.S_IMODE(os.stat(key_path).st_mode) & 0o077:
+        raise ValueError("the worker service key file " + key_path + " must only be accessible by its owner (chmod 600)")
+    with open(key_path, 'rb') as key_file:
+        key = key_file.read().strip()
+    if not key:
+        raise ValueError("the worker service key file " + key_path + " is empty")
+    return key
+
+# write a new random key readable only by its owner
+def WriteAuthKey(key_path):
+    key_fd = os.open(os.path.expanduser(key_path), os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600)
+    with os.fdopen(key_fd, 'w') as key_file:
+        key_file.write(secrets.token_hex(32) + "\n")
+
+# "host:port" for tcp, anything else is a unix socket path or windows pipe name
+def ParseAddress(address):
+    host, _, port = address.rpartition(':')
+    if host and port.isdigit():
+        return (host, int(port))
+    return address
+
+class JobQueue:
+    # Queued jobs per client, Get serves the clients round robin so one trial's cases
+    # do not hold back the trials that connected after it.
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.queues = collections.OrderedDict()
+
+    def Put(self, client_id, job):
+        with self.condition:
+            self.queues.setdefault(client_id, collections.deque()).append(job)
+            self.condition.notify()
+
+    def Get(self):
+        with self.condition:
+            while not self.queues:
+                self.condition.wait()
+            client_id, queue = next(iter(self.queues.items()))
+            job = queue.popleft()
+            del self.queues[client_id]
+            if queue:
+                self.queues[client_id] = queue
+            return client_id, job
+
+    # remove queued jobs of a client, all of them when job_ids is None, returns the removed job ids
+    def Cancel(self, client_id, job_ids=None):
+        with self.condition:
+            queue = self.queues.pop(client_id, None)
+            if queue is None:
+                return []
+            removed = [job for job in queue if job_ids is None or job[0] in job_ids]
+            queue = collections.deque(job for job in queue if job_ids is not None and job[0] not in job_ids)
+            if queue:
+                self.queues[client_id] = queue
+            return [job[0] for job in removed]
+
+class WorkerService:
+
+    def __init__(self, address, worker_cnt, authkey):
+        self.address = ParseAddress(address)
+        self.worker_cnt = worker_cnt
+        self.authkey = authkey
+        self.jobs = JobQueue()
+        self.clients = {}
+        self.cancel_events = {}
+        self.clients_lock = threading.Lock()
+        self.modules = {}
+        # running jobs and whether a module is being reloaded, a reload waits for the pool to be
+        # idle and holds back new jobs meanwhile so no job sees a half reloaded module
+        self.modules_condition = threading.Condition()
+        self.active_jobs = 0
+        self.reloading = False
+
+    # start a job: load its main module with the trial's settings, again when the file changed since
+    # it was loaded
+    def StartJob(self, module_name, settings):
+        if module_name not in SERVICE_MODULES:
+            raise ValueError("the worker service does not run jobs of " + repr(module_name))
+        module_path = os.path.join(SERVICE_DIR, module_name + ".py")
+        module_key = (module_name, repr(sorted(settings.items())))
+        with self.modules_condition:
+            while True:
+                while self.reloading:
+                    self.modules_condition.wait()
+                mtime = os.path.getmtime(module_path)
+                loaded = self.modules.get(module_key)
+                if loaded is not None and loaded[0] == mtime:
+                    self.active_jobs += 1
+                    return loaded[1]
+
+                self.reloading = True
+                try:
+                    while loaded is not None and self.active_jobs:
+                        self.modules_condition.wait()
+                    self.modules[module_key] = (mtime, LoadModule(module_name, module_path, settings))
+                finally:
+                    self.reloading = False
+                    self.modules_condition.notify_all()
+
+    def FinishJob(self):
+        with self.modules_condition:
+            self.active_jobs -= 1
+            self.modules_condition.notify_all()
+
+    def Send(self, client_id, message):
+        with self.clients_lock:
+            client = self.clients.get(client_id)
+        if client is None:
+            return
+        connection, send_lock = client
+        try:
+            with send_lock:
+                connection.send(message)
+        except (OSError, EOFError):
+            pass
+
+    def Work(self):
+        while True:
+            client_id, (job_id, module_name, function_name, args, settings) = self.jobs.Get()
+            self.Send(client_id, ("started", job_id))
+            with self.clients_lock:
+                cancel_event = self.cancel_events.get(client_id, threading.Event())
+            args = tuple(cancel_event if isinstance(arg, str) and arg == CANCEL_EVENT else arg for arg in args)
+            try:
+                if function_name not in SERVICE_FUNCTIONS:
+                    raise ValueError("the worker service does not run " + repr(function_name))
+                module = self.StartJob(module_name, settings)
+                try:
+                    message = ("result", job_id, True, getattr(module, function_name)(*args))
+                finally:
+                    self.FinishJob()
+            except Exception:
+                message = ("result", job_id, False, RuntimeError(str(function_name) + " failed in the worker service\n" + traceback.format_exc()))
+                print(message[3])
+            self.Send(client_id, message)
+
+    # tell a connecting trial whether its jobs can run here, None when they can
+    def CheckSettings(self, module_name, settings):
+        try:
+            self.StartJob(module_name, settings)
+        except Exception as error:
+            return str(error)
+        self.FinishJob()
+        return None
+
+    def Serve(self, connection, client_id):
+        with self.clients_lock:
+            self.clients[client_id] = (connection, threading.Lock())
+            self.cancel_events[client_id] = threading.Event()
+        try:
+            while True:
+                message = connection.recv()
+                if message[0] == "submit":
+                    self.jobs.Put(client_id, message[1:])
+                elif message[0] == "cancel":
+                    self.Send(client_id, ("dropped", self.jobs.Cancel(client_id, set(message[1]))))
+                elif message[0] == "stop":
+                    self.cancel_events[client_id].set()
+                elif message[0] == "check":
+                    self.Send(client_id, ("checked", self.CheckSettings(message[1], message[2])))
+        except (OSError, EOFError):
+            pass
+        finally:
+            # a trial that went away does not need its queued or running cases anymore
+            self.jobs.Cancel(client_id)
+            with self.clients_lock:
+                del self.clients[client_id]
+                self.cancel_events.pop(client_id).set()
+            connection.close()
+
+    def Run(self):
+        for _ in range(self.worker_cnt):
+            threading.Thread(target=self.Work, daemon=True).start()
+
+        with multiprocessing.connection.Listener(self.address, authkey=self.authkey) as listener:
+            print("Worker service with " + str(self.worker_cnt) + " workers listening on " + str(self.address))
+            client_cnt = 0
+            while True:
+                try:
+                    connection = listener.accept()
+                except (OSError, EOFError, multiprocessing.AuthenticationError) as error:
+                    print("Rejected connection: " + str(error))
+                    continue
+                client_cnt += 1
+                threading.Thread(target=self.Serve, args=(connection, client_cnt), daemon=True).start()
+
+# a private copy of a main module with the settings of a trial, copies with other settings and
+# jobs still running in an older copy keep their own globals
+def LoadModule(module_name, module_path, settings):
+    if SERVICE_DIR not in sys.path:
+        sys.path.insert(0, SERVICE_DIR)
+    spec = importlib.util.spec_from_file_location(module_name, module_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    for name, value in settings.items():
+        if name not in module.CASE_SETTINGS:
+            raise ValueError(name + " is not a case setting of " + module_name)
+        if name in SERVICE_FIXED_SETTINGS and value != getattr(module, name):
+            raise ValueError("the worker service runs " + name + "=" + str(getattr(module, name)) + ", not " + str(value))
+        setattr(module, name, value)
+    WarmReferences(module)
+    return module
+
+# load every cached reference of a main module that compares centerlines into memory
+def WarmReferences(module):
+    if not hasattr(module, "REFERENCE_CACHE_DIR") or not hasattr(module, "VMTK_VTKS_DIR"):
+        return
+    if not os.path.exists(module.VMTK_VTKS_DIR):
+        return
+    ReferenceCache.BuildReferenceCache(module.VMTK_VTKS_DIR, module.REFERENCE_CACHE_DIR)
+    for case_name in ReferenceStore.OpenReferenceStore(module.VMTK_VTKS_DIR).Cases():
+        ReferenceCache.LoadReference(module.REFERENCE_CACHE_DIR, case_name)
+
+class ServiceExecutor(concurrent.futures.Executor):
+    # Executor that runs run_case of a main module in the worker service with the trial's settings.
+    # A future is running once the service started its job, so cancel() only succeeds for queued
+    # jobs. Cancelled futures are removed from the service queue when the executor shuts down and
+    # shutdown waits for every job the service did not confirm as dropped. A threading.Event given
+    # to submit becomes the service's cancel event of this trial, once it is set shutdown has the
+    # service set it too.
+
+    def __init__(self, address, module_path, settings=None):
+        self.connection = multiprocessing.connection.Client(ParseAddress(address), authkey=ReadAuthKey())
+        self.module_name = os.path.splitext(os.path.basename(module_path))[0]
+        self.settings = settings or {}
+        self.connection.send(("check", self.module_name, self.settings))
+        _, error = self.connection.recv()
+        if error is not None:
+            self.connection.close()
+            raise ValueError(error)
+        self.send_lock = threading.Lock()
+        self.futures = {}
+        # jobs the service has not finished or dropped yet
+        self.outstanding = set()
+        self.outstanding_condition = threading.Condition()
+        self.next_job_id = 0
+        self.submitted_events = set()
+        self.reader = threading.Thread(target=self.ReadResults, daemon=True)
+        self.reader.start()
+
+    def ReadResults(self):
+        try:
+            while True:
+                message = self.connection.recv()
+                if message[0] == "started":
+                    future = self.futures.get(message[1])
+                    if future is not None:
+                        future.set_running_or_notify_cancel()
+                elif message[0] == "dropped":
+                    self.Done(message[1])
+                else:
+                    _, job_id, success, result = message
+                    future = self.futures.pop(job_id, None)
+                    self.Done([job_id])
+                    if future is None or future.cancelled() or not (future.running() or future.set_running_or_notify_cancel()):
+                        continue
+                    if success:
+                        future.set_result(result)
+                    else:
+                        future.set_exception(result)
+        except (OSError, EOFError):
+            for future in list(self.futures.values()):
+                if not future.cancelled() and (future.running() or future.set_running_or_notify_cancel()):
+                    future.set_exception(ConnectionError("lost the connection to the worker service"))
+            self.Done(list(self.outstanding))
+
+    def Done(self, job_ids):
+        with self.outstanding_condition:
+            self.outstanding.difference_update(job_ids)
+            self.outstanding_condition.notify_all()
+
+    def submit(self, fn, *args):
+        future = concurrent.futures.Future()
+        self.submitted_events.update(arg for arg in args if isinstance(arg, threading.Event))
+        args = tuple(CANCEL_EVENT if isinstance(arg, threading.Event) else arg for arg in args)
+        with self.send_lock:
+            job_id = self.next_job_id
+            self.next_job_id += 1
+            self.futures[job_id] = future
+            with self.outstanding_condition:
+                self.outstanding.add(job_id)
+            self.connection.send(("submit", job_id, self.module_name, fn.__name__, args, self.settings))
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        if cancel_futures:
+            for future in list(self.futures.values()):
+                future.cancel()
+        cancelled_ids = [job_id for job_id, future in list(self.futures.items()) if future.cancelled()]
+        try:
+            with self.send_lock:
+                if any(event.is_set() for event in self.submitted_events):
+                    self.connection.send(("stop",))
+                self.connection.send(("cancel", cancelled_ids))
+        except (OSError, EOFError):
+            pass
+        if wait:
+            # cancelled futures the service already started still write into the trial
+            with self.outstanding_condition:
+                while self.outstanding and self.reader.is_alive():
+                    self.outstanding_condition.wait(1)
+        self.connection.close()
+
+# executor for the cases of a trial: the worker service when an address is given, it is running and
+# can run the cases with the trial's settings, a local thread pool otherwise
+def CaseExecutor(address, module_path, local_worker_cnt, settings=None):
+    if address:
+        try:
+            return ServiceExecutor(address, module_path, settings)
+        except (OSError, EOFError, ValueError, multiprocessing.AuthenticationError) as error:
+            print("Worker service at " + address + " is not available (" + str(error) + "), running cases locally")
+    return concurrent.futures.ThreadPoolExecutor(max_workers=local_worker_cnt)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the local worker service shared by concurrent trials")
+    parser.add_argument("address", nargs="?", help="unix socket path / pipe name, or host:port for tcp")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--write-key", metavar="KEY_FILE", help="write a new key file readable only by its owner and exit")
+    args = parser.parse_args()
+
+    if args.write_key:
+        WriteAuthKey(args.write_key)
+        print("Wrote a new worker service key to " + args.write_key + ", set " + AUTHKEY_FILE_ENV + " to it")
+        sys.exit(0)
+    if not args.address:
+        parser.error("the address is required")
+    try:
+        authkey = ReadAuthKey()
+    except (OSError, ValueError) as error:
+        sys.exit("Worker service not started: " + str(error))
+    if not isinstance(ParseAddress(args.address), tuple) and os.name != 'nt' and os.path.exists(args.address):
+        os.remove(args.address)
+    WorkerService(args.address, args.workers, authkey).Run()
@@ -0,0 +1,40 @@
+import os
+import sys
+import random
+import itertools
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import CaseScheduler
+
+# LongestFirst checked with the makespans of the orders it produces: on small random case sets the
+# longest first order stays within Graham's 4/3 - 1/(3m) of the best assignment found by brute force.
+
+def OptimalMakespan(runtimes, worker_cnt):
+    best = float('inf')
+    for assignment in itertools.product(range(worker_cnt), repeat=len(runtimes)):
+        worker_times = [0.0] * worker_cnt
+        for worker, runtime in zip(assignment, runtimes):
+            worker_times[worker] += runtime
+        best = min(best, max(worker_times))
+    return best
+
+def StartOrder(runtimes):
+    case_names = ["Case_" + str(case_index).zfill(3) for case_index in range(len(runtimes))]
+    predicted = dict(zip(case_names, runtimes))
+    order = CaseScheduler.LongestFirst(range(len(runtimes)), case_names, predicted)
+    return [runtimes[case_index] for case_index in order]
+
+def test_longest_first_starts_the_big_case_first():
+    runtimes = [1.0, 1.0, 1.0, 1.0, 4.0]
+    assert StartOrder(runtimes)[0] == 4.0
+    assert CaseScheduler.Makespan(runtimes, 2) == 6.0
+    assert CaseScheduler.Makespan(StartOrder(runtimes), 2) == 4.0
+
+@pytest.mark.parametrize("worker_cnt", [2, 3])
+@pytest.mark.parametrize("seed", range(30))
+def test_longest_first_within_graham_bound(worker_cnt, seed):
+    rng = random.Random(seed)
+    runtimes = [rng.choice([rng.uniform(1, 10), rng.uniform(20, 200)]) for _ in range(rng.randint(worker_cnt + 1, 7))]
+    makespan = CaseScheduler.Makespan(StartOrder(runtimes), worker_cnt)
+    assert makespan <= (4 / 3 - 1 / (3 * worker_cnt)) * OptimalMakespan(runtimes, worker_cnt) + 1e-9
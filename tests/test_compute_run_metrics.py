@@ -0,0 +1,177 @@
+import os
+import sys
+import random
+import pytest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import RunSkeletonsMain
+import RunSkeletonsMain_PCL
+import SKJson2VTk
+import SyntheticSkeleton
+
+# ComputeRunMetrics checked against the implementation it replaced, which compared the ends of every
+# polyline with those of every other polyline, on random skeletons given as json data and as Skeleton.
+
+TRIAL_METRICS = {
+    "passed":0,
+    "bifurcations": 0,
+    "termina": 0,
+    "avg_degree": 0,
+    "skeleton_length": 0,
+    "total_time": 0
+}
+
+def euclidean_distance(p1, p2):
+    """Compute the Euclidean distance between two 3D points."""
+    return ((p1[0] - p2[0])**2 + (p1[1] - p2[1])**2 + (p1[2] - p2[2])**2)**0.5
+
+def polyline_length(polyline):
+    """Compute the length of a polyline."""
+    return sum(euclidean_distance(polyline[i], polyline[i+1]) for i in range(len(polyline) - 1))
+
+# ComputeRunMetrics as it was before the endpoint index, the oracle of these tests
+def ReferenceComputeRunMetrics(skeletonJsonData):
+    polylines = skeletonJsonData['Polylines']
+
+    sk_points = []
+    raw_sk_points = skeletonJsonData['SkPoints']
+    for i in range(int(len(raw_sk_points)/3)):
+        sk_points.append([raw_sk_points[i * 3 + 0],raw_sk_points[i * 3 + 1],raw_sk_points[i * 3 + 2]])
+
+    bifurcations = {}
+    termina_cnt = 0
+
+    # List to store polylines that have both ends as bifurcations
+    polylines_between_bifurcations = []
+    skeleton_length = 0
+
+    # Loop through each polyline to check its ends
+    for current_polyline in polylines:
+        start_point = current_polyline[0]
+        end_point = current_polyline[-1]
+
+        start_is_bifurcation = False
+        end_is_bifurcation = False
+
+        # Check the current polyline's ends against the ends of all other polylines
+        for other_polyline in polylines:
+            if current_polyline == other_polyline:
+                continue
+
+            other_ends = [other_polyline[0], other_polyline[-1]]
+            if start_point in other_ends:
+                start_is_bifurcation = True
+            if end_point in other_ends:
+                end_is_bifurcation = True
+
+        if start_is_bifurcation:
+            bifurcations[start_point] = 0
+
+        if end_is_bifurcation:
+            bifurcations[end_point] = 0
+
+        if start_is_bifurcation and end_is_bifurcation:
+            polylines_between_bifurcations.append(current_polyline)
+
+        # if only one condition is true
+        if start_is_bifurcation ^ end_is_bifurcation:
+            termina_cnt += 1
+
+    sum_degree = 0
+    avg_degree = 0
+    # Loop over each bifurcation and find its degree
+    for bi in bifurcations:
+        for polyline in polylines:
+            if bi in polyline:
+                sum_degree += 1
+    avg_degree = sum_degree / len(bifurcations)
+
+    # Loop through each polyline to compute its length
+    for polyline_ids in polylines_between_bifurcations:
+        polyline = []
+        for id in polyline_ids:
+            polyline.append(sk_points[id])
+        skeleton_length += polyline_length(polyline)
+
+    out_metrics = TRIAL_METRICS.copy()
+    out_metrics["bifurcations"] = len(bifurcations)
+    out_metrics["termina"] = termina_cnt
+    out_metrics["avg_degree"] = avg_degree
+    out_metrics["skeleton_length"] = skeleton_length
+
+    return out_metrics
+
+# json data of a random graph of polylines between a few shared nodes, with the cases the endpoint
+# index has to get right: identical and reversed copies, loops, single point polylines and nodes
+# that other polylines pass through
+def RandomSkeletonData(seed):
+    rng = random.Random(seed)
+    node_cnt = rng.randint(2, 12)
+    point_cnt = node_cnt
+    polylines = []
+    for _ in range(rng.randint(2, 40)):
+        kind = rng.random()
+        if polylines and kind < 0.1:
+            polylines.append(list(rng.choice(polylines)))
+            continue
+        if polylines and kind < 0.2:
+            polylines.append(list(reversed(rng.choice(polylines))))
+            continue
+        if kind < 0.25:
+            polylines.append([rng.randrange(node_cnt)])
+            continue
+        start = rng.randrange(node_cnt)
+        end = start if kind < 0.3 else rng.randrange(node_cnt)
+        interior = list(range(point_cnt, point_cnt + rng.randint(0, 6)))
+        point_cnt += len(interior)
+        if interior and rng.random() < 0.2:
+            interior.insert(rng.randrange(len(interior)), rng.randrange(node_cnt))
+        polylines.append([start] + interior + [end])
+    rng.shuffle(polylines)
+    points = [rng.uniform(-50, 50) for _ in range(point_cnt * 3)]
+    return {SKJson2VTk.SKPOINTS_KEY: points, SKJson2VTk.POLYLINES_KEY: polylines}
+
+# json data of a synthetic vessel tree as the mock SK_Lite writes it
+def SyntheticSkeletonData(seed):
+    skeleton_data = SyntheticSkeleton.GenerateSkeletonData(random.Random(seed).randint(200, 20000), seed=seed)
+    return {SKJson2VTk.SKPOINTS_KEY: np.asarray(skeleton_data[SKJson2VTk.SKPOINTS_KEY], dtype=float).reshape(-1).tolist(),
+            SKJson2VTk.POLYLINES_KEY: skeleton_data[SKJson2VTk.POLYLINES_KEY].tolist()}
+
+def HasBifurcation(skeleton_data):
+    polylines = skeleton_data[SKJson2VTk.POLYLINES_KEY]
+    return any(polyline[0] in (other[0], other[-1]) or polyline[-1] in (other[0], other[-1])
+               for polyline in polylines for other in polylines if polyline != other)
+
+def AssertSameMetrics(metrics, expected):
+    assert metrics["bifurcations"] == expected["bifurcations"]
+    assert metrics["termina"] == expected["termina"]
+    assert metrics["avg_degree"] == expected["avg_degree"]
+    assert metrics["skeleton_length"] == expected["skeleton_length"]
+
+@pytest.mark.parametrize("main_module", [RunSkeletonsMain, RunSkeletonsMain_PCL])
+@pytest.mark.parametrize("seed", range(200))
+def test_random_graphs_match_reference(main_module, seed):
+    skeleton_data = RandomSkeletonData(seed)
+    if not HasBifurcation(skeleton_data):
+        pytest.skip("no bifurcation, average degree is undefined")
+    expected = ReferenceComputeRunMetrics(skeleton_data)
+    AssertSameMetrics(main_module.ComputeRunMetrics(skeleton_data), expected)
+    AssertSameMetrics(main_module.ComputeRunMetrics(SKJson2VTk.Skeleton.FromJsonData(skeleton_data)), expected)
+
+@pytest.mark.parametrize("main_module", [RunSkeletonsMain, RunSkeletonsMain_PCL])
+@pytest.mark.parametrize("seed", range(10))
+def test_synthetic_trees_match_reference(main_module, seed):
+    skeleton_data = SyntheticSkeletonData(seed)
+    if not HasBifurcation(skeleton_data):
+        pytest.skip("a single polyline has no bifurcation")
+    AssertSameMetrics(main_module.ComputeRunMetrics(skeleton_data), ReferenceComputeRunMetrics(skeleton_data))
+
+# without any bifurcation both divide by zero for the average degree
+@pytest.mark.parametrize("main_module", [RunSkeletonsMain, RunSkeletonsMain_PCL])
+def test_no_bifurcation_raises_like_reference(main_module):
+    skeleton_data = {SKJson2VTk.SKPOINTS_KEY: [0.0, 0.0, 0.0, 1.0, 0.0, 0.0], SKJson2VTk.POLYLINES_KEY: [[0, 1]]}
+    with pytest.raises(ZeroDivisionError):
+        ReferenceComputeRunMetrics(skeleton_data)
+    with pytest.raises(ZeroDivisionError):
+        main_module.ComputeRunMetrics(skeleton_data)